@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Tests of the utilities shared by the benchmark scripts.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import benchutil
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Part of the GCC 12 -ftime-report output for a TU including <iostream>,
+# <map> and <string>.
+TIME_REPORT = """\
+Time variable                                   usr           sys          wall           GGC
+ phase setup                        :   0.00 (  0%)   0.00 (  0%)   0.00 (  0%)  1576k (  3%)
+ phase parsing                      :   0.25 ( 64%)   0.15 ( 79%)   0.41 ( 69%)    42M ( 76%)
+ phase lang. deferred               :   0.05 ( 13%)   0.01 (  5%)   0.06 ( 10%)  7619k ( 13%)
+ phase opt and generate             :   0.09 ( 23%)   0.03 ( 16%)   0.12 ( 20%)  4746k (  8%)
+ |name lookup                       :   0.04 ( 10%)   0.03 ( 16%)   0.06 ( 10%)  2356k (  4%)
+ |overload resolution               :   0.03 (  8%)   0.02 ( 11%)   0.03 (  5%)  5631k ( 10%)
+ callgraph functions expansion      :   0.06 ( 15%)   0.02 ( 11%)   0.07 ( 12%)  1931k (  3%)
+ preprocessing                      :   0.04 ( 10%)   0.02 ( 11%)   0.10 ( 17%)  1703k (  3%)
+ parser (global)                    :   0.05 ( 13%)   0.04 ( 21%)   0.08 ( 14%)    13M ( 25%)
+ template instantiation             :   0.09 ( 23%)   0.04 ( 21%)   0.14 ( 24%)    17M ( 30%)
+ TOTAL                              :   0.39          0.19          0.59           56M
+"""
+
+
+def sweep_rows(time):
+  """Returns rows as written by run-benchmarks.py sweep"""
+  return [{'method': 'format_int', 'config': 'int-benchmark',
+           'args': [size, 0], 'run': run, 'time': time * (1 + run / 100),
+           'threads': 1, 'working_set': size * 4}
+          for size in (1000, 100000) for run in range(5)]
+
+
+class ParseTimeReportTest(unittest.TestCase):
+  def test_leaf_timevars(self):
+    phases = benchutil.parse_time_report(TIME_REPORT)
+    self.assertEqual(sorted(phases), [
+      'callgraph functions expansion', 'parser (global)', 'preprocessing',
+      'template instantiation'])
+    self.assertAlmostEqual(phases['template instantiation'], 0.13)
+    self.assertAlmostEqual(phases['preprocessing'], 0.06)
+
+  def test_sum_reports(self):
+    phases = benchutil.parse_time_report(TIME_REPORT + TIME_REPORT)
+    self.assertAlmostEqual(phases['template instantiation'], 0.26)
+
+
+class CompareTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def write_results(self, name, rows):
+    filename = os.path.join(self.dir, name)
+    benchutil.ResultsWriter(filename, 'run-benchmarks').write(rows)
+    return filename
+
+  def compare(self, *filenames):
+    p = subprocess.Popen(
+      [sys.executable, os.path.join(script_dir, 'variadic-test.py'),
+       'compare'] + list(filenames),
+      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0].decode()
+    return p.returncode, output
+
+  def test_group_sweep_runs(self):
+    groups = benchutil.group_runs(
+      benchutil.load_results(self.write_results('a.jsonl', sweep_rows(1))))
+    self.assertEqual(
+      sorted(groups),
+      [('run-benchmarks', 'format_int', 'int-benchmark', (1000, 0)),
+       ('run-benchmarks', 'format_int', 'int-benchmark', (100000, 0))])
+
+  def test_compare_sweep(self):
+    baseline = self.write_results('baseline.jsonl', sweep_rows(1))
+    status, output = self.compare(baseline, baseline)
+    self.assertEqual(status, 0, output)
+    self.assertIn('No regressions found', output)
+
+  def test_compare_sweep_regression(self):
+    baseline = self.write_results('baseline.jsonl', sweep_rows(1))
+    slower = self.write_results('slower.jsonl', sweep_rows(2))
+    status, output = self.compare(baseline, slower)
+    self.assertEqual(status, 1, output)
+    self.assertIn('1000/0', output)
+    self.assertIn('100000/0', output)
+
+
+if __name__ == '__main__':
+  unittest.main()
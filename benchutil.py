@@ -0,0 +1,992 @@
+# Utilities shared by the compile-time benchmark scripts.
+
+from __future__ import print_function, division
+
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from subprocess import CalledProcessError, PIPE, Popen, check_output
+from timeit import default_timer
+
+# Flags that only affect linking and are dropped when compiling objects.
+LINK_ONLY_FLAGS = ('-l', '-L', '-Wl,', '-fuse-ld=')
+
+
+class Table:
+  """Prints a reStructuredText table"""
+
+  def __init__(self, header, formats, widths=None):
+    self.widths = [len(i) for i in header]
+    for i, width in enumerate(widths or []):
+      self.widths[i] = max(self.widths[i], width)
+    self.formats = formats
+
+    self.print_rulers()
+    for field, width in zip(header, self.widths):
+      print(self.format_field(field, '', width), end=' ')
+    print()
+    self.print_rulers()
+
+  @staticmethod
+  def format_field(field, fmt='', width=''):
+    return '{:{}{}}'.format(field, width, fmt)
+
+  def print_rulers(self):
+    for w in self.widths:
+      print('=' * w, end=' ')
+    print()
+
+  def print_row(self, *row):
+    for field, fmt, width in zip(row, self.formats, self.widths):
+      print(self.format_field(field, fmt, width), end=' ')
+    print()
+
+
+def default_jobs():
+  try:
+    return cpu_count()
+  except NotImplementedError:
+    return 1
+
+
+def available_cpus():
+  """Returns the CPUs this process may run on ordered so that hyperthreads of
+  the same physical core are adjacent"""
+  if hasattr(os, 'sched_getaffinity'):
+    cpus = os.sched_getaffinity(0)
+  else:
+    cpus = range(default_jobs())
+
+  def topology(cpu):
+    ids = []
+    for name in 'physical_package_id', 'core_id':
+      path = '/sys/devices/system/cpu/cpu{}/topology/{}'.format(cpu, name)
+      try:
+        with open(path) as f:
+          ids.append(int(f.read()))
+      except (IOError, ValueError):
+        ids.append(0)
+    return ids + [cpu]
+
+  return sorted(cpus, key=topology)
+
+
+def cpu_sets(jobs, cpus_per_job):
+  """Splits the available CPUs into at most jobs disjoint sets of
+  cpus_per_job CPUs each"""
+  cpus = available_cpus()
+  num_sets = max(1, min(jobs, len(cpus) // cpus_per_job))
+  return [cpus[i * cpus_per_job:(i + 1) * cpus_per_job]
+          for i in range(num_sets)]
+
+
+def pin_to_cpus(cpus):
+  """Restricts the current process and its future children to cpus"""
+  if not hasattr(os, 'sched_setaffinity'):
+    print('CPU pinning is not supported on this platform')
+    return
+  os.sched_setaffinity(0, cpus)
+
+
+def run(command, **kwargs):
+  """Runs command and returns its wall time, CPU time and peak memory usage.
+
+  The resource usage is collected with wait4 so that it covers only this
+  command and the processes it spawned (e.g. cc1plus, as and ld for g++)
+  even if several commands are running concurrently.
+  """
+  start = default_timer()
+  p = Popen(command, **kwargs)
+  _, status, usage = os.wait4(p.pid, 0)
+  wall_time = default_timer() - start
+  if os.WIFSIGNALED(status):
+    p.returncode = -os.WTERMSIG(status)
+  else:
+    p.returncode = os.WEXITSTATUS(status)
+  if p.returncode != 0:
+    raise CalledProcessError(p.returncode, command)
+  return {
+    'wall_time': wall_time,
+    'cpu_time': usage.ru_utime + usage.ru_stime,
+    'user_time': usage.ru_utime,
+    'sys_time': usage.ru_stime,
+    'max_rss': usage.ru_maxrss,
+    'voluntary_context_switches': usage.ru_nvcsw,
+    'involuntary_context_switches': usage.ru_nivcsw
+  }
+
+
+def compiler_family(compiler_path):
+  version = check_output([compiler_path, '--version']).decode()
+  return 'clang' if 'clang' in version.lower() else 'gcc'
+
+
+def time_report_flags(compiler_path):
+  """Returns the flags that make the compiler report time spent per phase"""
+  if compiler_family(compiler_path) == 'clang':
+    return ['-ftime-trace']
+  return ['-ftime-report']
+
+
+def without_time_report(flags):
+  """Returns flags without the flags added by time_report_flags"""
+  return [f for f in flags if f not in ('-ftime-report', '-ftime-trace')]
+
+
+# Matches a line of the GCC -ftime-report output such as
+#  phase parsing   :   0.41 ( 87%)   0.24 ( 92%)   0.67 ( 89%)    36M ( 86%)
+TIME_REPORT_RE = re.compile(
+  r'^ (\S.*?)\s*:\s*([\d.]+) \(\s*\d+%\)\s+([\d.]+) \(\s*\d+%\)')
+
+
+def parse_time_report(text):
+  """Returns a dict mapping phases in GCC -ftime-report output to user plus
+  system time in seconds, summed over all reports in text.
+
+  Only the leaf timevars such as "template instantiation" are returned. The
+  "phase ..." totals include them and the "|name lookup" style entries are
+  nested in them so adding either would count the same time twice.
+  """
+  phases = {}
+  for line in text.splitlines():
+    m = TIME_REPORT_RE.match(line)
+    if m and m.group(1) != 'TOTAL' and \
+       not m.group(1).startswith(('phase ', '|')):
+      phase = m.group(1)
+      phases[phase] = \
+        phases.get(phase, 0) + float(m.group(2)) + float(m.group(3))
+  return phases
+
+
+def parse_time_trace(filename):
+  """Returns a dict mapping phases to time in seconds from the totals in a
+  clang -ftime-trace file"""
+  with open(filename) as f:
+    trace = json.load(f)
+  phases = {}
+  for event in trace.get('traceEvents', []):
+    name = event.get('name', '')
+    if name.startswith('Total '):
+      phase = name[len('Total '):]
+      phases[phase] = phases.get(phase, 0) + event.get('dur', 0) / 1e6
+  return phases
+
+
+def add_phases(total, phases):
+  for phase, time in phases.items():
+    total[phase] = total.get(phase, 0) + time
+  return total
+
+
+def top_phases(phase_dicts, n):
+  """Returns the names of n phases with the largest total time"""
+  total = {}
+  for phases in phase_dicts:
+    add_phases(total, phases)
+  return sorted(total, key=total.get, reverse=True)[:n]
+
+
+def run_with_phases(command, trace_filenames=(), **kwargs):
+  """Runs a compiler command with time report flags and returns the run
+  result with the per-phase times under 'phases'.
+
+  trace_filenames is a function returning the names of the clang trace files
+  written by the command which are parsed and removed.
+  """
+  with tempfile.TemporaryFile() as stderr:
+    try:
+      result = run(command, stderr=stderr, **kwargs)
+    except CalledProcessError:
+      stderr.seek(0)
+      sys.stderr.write(stderr.read().decode('utf-8', 'replace'))
+      raise
+    stderr.seek(0)
+    text = stderr.read().decode('utf-8', 'replace')
+  result['phases'] = parse_time_report(text)
+  if trace_filenames:
+    for filename in trace_filenames():
+      add_phases(result['phases'], parse_time_trace(filename))
+      os.remove(filename)
+  return result
+
+
+def output_digest(command, **kwargs):
+  """Runs command and returns the SHA-256 digest and the size of its output.
+
+  The output is hashed in chunks as it is produced so that memory usage
+  doesn't depend on the output size.
+  """
+  digest = hashlib.sha256()
+  size = 0
+  p = Popen(command, stdout=PIPE, **kwargs)
+  for chunk in iter(lambda: p.stdout.read(64 * 1024), b''):
+    digest.update(chunk)
+    size += len(chunk)
+  p.stdout.close()
+  if p.wait() != 0:
+    raise CalledProcessError(p.returncode, command)
+  return digest.hexdigest(), size
+
+
+def split_flags(flags):
+  """Returns the subset of flags that should be passed when compiling"""
+  return [f for f in flags if not f.startswith(LINK_ONLY_FLAGS)]
+
+
+def object_filename(source, object_dir=None):
+  filename = os.path.splitext(source)[0] + '.o'
+  if object_dir:
+    filename = os.path.join(object_dir, os.path.basename(filename))
+  return filename
+
+
+def compile_objects(compiler_path, sources, flags, jobs, time_report=False,
+                    launcher=(), env=None, object_dir=None):
+  """Compiles each source to an object file using up to jobs processes.
+
+  If time_report is true, flags should include time_report_flags and the
+  per-phase times of each TU are returned under 'phases'. launcher is a
+  command such as ccache that the compiler is run with and env is the
+  environment of the compiler processes. Object files are written next to
+  the sources unless object_dir is given.
+  """
+  compile_flags = split_flags(flags)
+
+  def compile_source(source):
+    obj = object_filename(source, object_dir)
+    if os.path.exists(obj):
+      os.remove(obj)
+    command = list(launcher) + [compiler_path, '-c', '-o', obj, source] + \
+      compile_flags
+    if time_report:
+      trace = os.path.splitext(obj)[0] + '.json'
+      result = run_with_phases(
+        command, lambda: [trace] if os.path.exists(trace) else [], env=env)
+    else:
+      result = run(command, env=env)
+    result['source'] = source
+    result['object'] = obj
+    return result
+
+  pool = ThreadPool(max(1, min(jobs, len(sources))))
+  try:
+    return pool.map(compile_source, sources)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def link(compiler_path, objects, output_filename, flags):
+  """Links objects into an executable"""
+  if os.path.exists(output_filename):
+    os.remove(output_filename)
+  return run([compiler_path, '-o', output_filename] + objects + flags)
+
+
+def build(compiler_path, sources, output_filename, flags, jobs,
+          time_report=False, launcher=(), env=None, object_dir=None):
+  """Compiles sources in parallel and links them into output_filename.
+
+  Returns a dict with the elapsed wall time of the whole build, the CPU time
+  summed over all compiler and linker processes, which is comparable to the
+  time of a serial build, and the per-TU and link measurements. With
+  time_report, the per-phase times summed over all TUs are returned under
+  'phases'. launcher, env and object_dir are used for compiling only, see
+  compile_objects.
+  """
+  start = default_timer()
+  units = compile_objects(compiler_path, sources, flags, jobs, time_report,
+                          launcher, env, object_dir)
+  link_result = link(compiler_path, [u['object'] for u in units],
+                     output_filename, flags)
+  result = {
+    'wall_time': default_timer() - start,
+    'cpu_time': sum(u['cpu_time'] for u in units) + link_result['cpu_time'],
+    'units': units,
+    'link': link_result
+  }
+  if time_report:
+    result['phases'] = {}
+    for u in units:
+      add_phases(result['phases'], u['phases'])
+  return result
+
+
+# Linkers that can be selected with -fuse-ld, 'default' is the compiler's
+# default linker.
+LINKERS = ('bfd', 'gold', 'lld', 'mold')
+
+# Link-time optimization modes and their flags. Thin LTO is supported by clang
+# only.
+LTO_FLAGS = {'none': [], 'full': ['-flto'], 'thin': ['-flto=thin']}
+
+
+def available_linkers(compiler_path):
+  """Returns the linkers from LINKERS that compiler_path can link with"""
+  directory = tempfile.mkdtemp()
+  try:
+    source = os.path.join(directory, 'main.cc')
+    with open(source, 'w') as f:
+      f.write('int main() {}\n')
+    obj = object_filename(source)
+    check_output([compiler_path, '-c', '-o', obj, source])
+    linkers = []
+    for linker in LINKERS:
+      p = Popen([compiler_path, '-fuse-ld=' + linker, '-o',
+                 os.path.join(directory, 'a.out'), obj],
+                stdout=PIPE, stderr=PIPE)
+      p.communicate()
+      if p.returncode == 0:
+        linkers.append(linker)
+    return linkers
+  finally:
+    shutil.rmtree(directory)
+
+
+def parse_link_matrix(parser, compiler_path, linkers, lto_modes):
+  """Returns a list of [linker, lto] combinations from comma-separated lists
+  of linkers and LTO modes or an empty list if only the default linker
+  without LTO is requested. The linker 'all' stands for all available
+  linkers."""
+  linkers = linkers.split(',')
+  lto_modes = lto_modes.split(',')
+  if linkers == ['default'] and lto_modes == ['none']:
+    return []
+  available = available_linkers(compiler_path)
+  if 'all' in linkers:
+    i = linkers.index('all')
+    linkers[i:i + 1] = [l for l in available if l not in linkers]
+  for linker in linkers:
+    if linker != 'default' and linker not in available:
+      parser.error('linker {} is not available, available linkers: {}'.format(
+        linker, ', '.join(available)))
+  for lto in lto_modes:
+    if lto not in LTO_FLAGS:
+      parser.error('invalid LTO mode {}, expected one of {}'.format(
+        lto, ', '.join(LTO_FLAGS)))
+    if lto == 'thin' and compiler_family(compiler_path) != 'clang':
+      parser.error('thin LTO is only supported by clang')
+  return [[linker, lto] for lto in lto_modes for linker in linkers]
+
+
+def link_flags(linker, lto):
+  """Returns the flags selecting linker and LTO mode lto"""
+  flags = list(LTO_FLAGS[lto])
+  if linker != 'default':
+    flags.append('-fuse-ld=' + linker)
+  return flags
+
+
+def link_matrix(compiler_path, sources, flags, jobs, combinations,
+                output_filename, sampling_options, object_dir=None):
+  """Links sources with each [linker, lto] combination.
+
+  The sources are compiled once per LTO mode. Returns a list of dicts with the
+  linker, the LTO mode, the CPU time of compiling the sources, the median CPU
+  and wall time and peak memory usage of linking over samples taken according
+  to sampling_options and the sizes of the executable and its stripped
+  version.
+  """
+  results = []
+  compiled_lto = None
+  # The compilations are not timed per phase.
+  flags = without_time_report(flags)
+  for linker, lto in combinations:
+    if lto != compiled_lto:
+      units = compile_objects(compiler_path, sources, flags + LTO_FLAGS[lto],
+                              jobs, object_dir=object_dir)
+      compiled_lto = lto
+    objects = [u['object'] for u in units]
+    samples, summary = sample(
+      lambda: link(compiler_path, objects, output_filename,
+                   flags + link_flags(linker, lto)),
+      lambda r: r['cpu_time'], sampling_options)
+    stripped_filename = output_filename + '.stripped'
+    check_output(['strip', '-o', stripped_filename, output_filename])
+    results.append({
+      'linker': linker,
+      'lto': lto,
+      'compile_time': sum(u['cpu_time'] for u in units),
+      'time': summary['median'],
+      'wall_time': median([r['wall_time'] for r in samples]),
+      'max_rss': median([r['max_rss'] for r in samples]),
+      'size': os.stat(output_filename).st_size,
+      'stripped_size': os.stat(stripped_filename).st_size
+    })
+    os.remove(stripped_filename)
+  return results
+
+
+def find_program(name):
+  """Returns the path of the executable name in PATH or None"""
+  for path in os.getenv('PATH', '').split(os.pathsep):
+    filename = os.path.join(path, name)
+    if os.path.isfile(filename) and os.access(filename, os.X_OK):
+      return filename
+  return None
+
+
+def directory_size(path):
+  """Returns the total size of the files in path and its subdirectories"""
+  size = 0
+  for root, _, filenames in os.walk(path):
+    for filename in filenames:
+      size += os.path.getsize(os.path.join(root, filename))
+  return size
+
+
+def ccache_env(cache_dir):
+  """Returns the environment for running ccache with a private cache in
+  cache_dir unaffected by the user's cache and configuration"""
+  env = dict(os.environ)
+  for name in list(env):
+    if name.startswith('CCACHE_'):
+      del env[name]
+  env['CCACHE_DIR'] = cache_dir
+  env['CCACHE_CONFIGPATH'] = os.path.join(cache_dir, 'ccache.conf')
+  return env
+
+
+# Ways of using the headers of a formatting method: including them in each TU,
+# including a precompiled header built from them or importing a header unit.
+HEADER_MODES = ('include', 'pch', 'header-unit')
+
+# Imports the header unit named by the HEADER_UNIT macro in header-unit mode
+# and does nothing otherwise. Written at the start of generated sources
+# because GCC doesn't translate headers included with -include into imports.
+HEADER_UNIT_PRELUDE = '#ifdef HEADER_UNIT\nimport HEADER_UNIT;\n#endif\n'
+
+
+def parse_header_modes(parser, modes):
+  """Returns a list of header modes from a comma-separated string"""
+  result = modes.split(',')
+  for mode in result:
+    if mode not in HEADER_MODES:
+      parser.error('invalid header mode {}, expected one of {}'.format(
+        mode, ', '.join(HEADER_MODES)))
+  return result
+
+
+def header_mode_config(config, mode):
+  """Returns the config name under which the results of a header mode are
+  stored so that they are compared and plotted separately"""
+  return config if mode == 'include' else '{}/{}'.format(config, mode)
+
+
+def write_header(filename, includes):
+  """Writes a header that includes each of includes such as '<stdio.h>'"""
+  directory = os.path.dirname(filename)
+  if directory and not os.path.exists(directory):
+    os.makedirs(directory)
+  with open(filename, 'w') as f:
+    f.write('#ifndef PRECOMPILED_H_\n#define PRECOMPILED_H_\n')
+    for include in includes:
+      f.write('#include {}\n'.format(include))
+    f.write('#endif\n')
+
+
+def precompiled_filename(compiler_path, header, mode):
+  """Returns the name of the file header is precompiled to in mode"""
+  clang = compiler_family(compiler_path) == 'clang'
+  if mode == 'pch':
+    return header + ('.pch' if clang else '.gch')
+  return os.path.splitext(header)[0] + ('.pcm' if clang else '.gcm')
+
+
+def header_mode_flags(compiler_path, header, mode):
+  """Returns the flags that make TUs use header precompiled in mode.
+
+  header should be an absolute path. Header units require C++20 so the flags
+  select it overriding an earlier -std option.
+  """
+  if mode == 'include':
+    return []
+  if mode == 'pch':
+    # Both GCC and clang pick up the precompiled header next to the included
+    # one, -Winvalid-pch reports if it cannot be used.
+    return ['-include', header, '-Winvalid-pch']
+  flags = ['-std=c++20', '-DHEADER_UNIT="{}"'.format(header)]
+  cmi = precompiled_filename(compiler_path, header, mode)
+  if compiler_family(compiler_path) == 'clang':
+    return flags + ['-fmodule-file=' + cmi]
+  # Map the header unit to its CMI instead of using gcm.cache in the
+  # current directory.
+  mapper = os.path.splitext(header)[0] + '.map'
+  return flags + ['-fmodules-ts', '-fmodule-mapper=' + mapper]
+
+
+def precompile_header(compiler_path, header, flags, mode):
+  """Precompiles header for use with header_mode_flags in mode.
+
+  flags should be the flags TUs are compiled with, excluding the ones
+  returned by header_mode_flags. Returns the run result of the compiler
+  with the size of the precompiled header under 'size'.
+  """
+  output = precompiled_filename(compiler_path, header, mode)
+  if os.path.exists(output):
+    os.remove(output)
+  compile_flags = split_flags(flags)
+  if mode == 'pch':
+    command = [compiler_path, '-x', 'c++-header', '-o', output, header]
+  elif compiler_family(compiler_path) == 'clang':
+    command = [compiler_path, '-std=c++20', '-fmodule-header', '-o', output,
+               header]
+  else:
+    mapper = os.path.splitext(header)[0] + '.map'
+    with open(mapper, 'w') as f:
+      f.write('{} {}\n'.format(header, output))
+    command = [compiler_path, '-std=c++20', '-fmodules-ts',
+               '-fmodule-mapper=' + mapper, '-x', 'c++-header', header]
+  # Put the flags first so that the -std option above takes precedence.
+  result = run(command[:1] + compile_flags + command[1:])
+  result['size'] = os.stat(output).st_size
+  return result
+
+
+def section_sizes(filenames):
+  """Returns a list of (text, data, bss) sizes of object files as reported
+  by size"""
+  output = check_output(['size'] + list(filenames)).decode()
+  return [tuple(int(n) for n in line.split()[:3])
+          for line in output.splitlines()[1:]]
+
+
+# Prefixes of demangled names of compiler-generated symbols.
+SPECIAL_SYMBOL_PREFIXES = (
+  'construction vtable for ', 'vtable for ', 'VTT for ',
+  'typeinfo name for ', 'typeinfo for ', 'guard variable for ',
+  'non-virtual thunk to ', 'virtual thunk to ', 'covariant return thunk to ',
+  'transaction clone for ', 'TLS init function for ', 'TLS wrapper function for '
+)
+
+# Namespaces that are reported as part of other namespaces.
+NAMESPACE_ALIASES = {'__gnu_cxx': 'std', '__cxxabiv1': 'std', 'tfm': 'tinyformat'}
+
+
+def symbol_sizes(filename):
+  """Returns a list of (size, name) pairs of the symbols in an executable with
+  demangled names sorted by size"""
+  output = check_output(['nm', '--size-sort', '-S', '-C', filename]).decode()
+  symbols = []
+  for line in output.splitlines():
+    fields = line.split(None, 3)
+    if len(fields) == 4:
+      symbols.append((int(fields[1], 16), fields[3]))
+  return symbols
+
+
+def symbol_namespace(name):
+  """Returns the outermost namespace of a demangled symbol name or an empty
+  string for global symbols"""
+  for prefix in SPECIAL_SYMBOL_PREFIXES:
+    if name.startswith(prefix):
+      name = name[len(prefix):]
+      break
+  name = name.replace('(anonymous namespace)::', '')
+  # Drop operators that contain angle brackets, template arguments,
+  # function parameters and return types.
+  name = re.sub(r'operator\s*(<<=?|>>=?|<=?|>=?|->\*?)', 'operator', name)
+  name = name.split('(')[0]
+  while True:
+    stripped = re.sub(r'<[^<>]*>', '', name)
+    if stripped == name:
+      break
+    name = stripped
+  words = name.split()
+  if not words or '::' not in words[-1]:
+    return ''
+  namespace = words[-1].split('::')[0]
+  return NAMESPACE_ALIASES.get(namespace, namespace)
+
+
+def namespace_sizes(symbols):
+  """Returns a dict mapping namespaces to the total size of their symbols"""
+  sizes = {}
+  for size, name in symbols:
+    namespace = symbol_namespace(name)
+    sizes[namespace] = sizes.get(namespace, 0) + size
+  return sizes
+
+
+def percentile(values, p):
+  """Returns the p-th percentile of values using linear interpolation"""
+  values = sorted(values)
+  pos = (len(values) - 1) * p / 100
+  lo = int(pos)
+  hi = min(lo + 1, len(values) - 1)
+  return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def distribution(values):
+  """Returns the (min, median, p95, max) of values"""
+  return (min(values), percentile(values, 50), percentile(values, 95),
+          max(values))
+
+
+def median(values):
+  return percentile(values, 50)
+
+
+def mad(values):
+  """Returns the median absolute deviation of values"""
+  m = median(values)
+  return median([abs(v - m) for v in values])
+
+
+def bootstrap_ci(values, confidence=0.95, resamples=1000):
+  """Returns a bootstrap confidence interval of the median of values"""
+  # Use a fixed seed to make the reported intervals reproducible.
+  rng = random.Random(0)
+  n = len(values)
+  medians = [median([values[rng.randrange(n)] for _ in range(n)])
+             for _ in range(resamples)]
+  alpha = (1 - confidence) / 2 * 100
+  return percentile(medians, alpha), percentile(medians, 100 - alpha)
+
+
+def summarize(samples):
+  """Returns the median, MAD and 95% confidence interval of samples"""
+  ci_low, ci_high = bootstrap_ci(samples)
+  return {
+    'median': median(samples),
+    'mad': mad(samples),
+    'ci_low': ci_low,
+    'ci_high': ci_high,
+    'samples': samples
+  }
+
+
+def ci_width(summary):
+  """Returns the width of the confidence interval in percent of the median"""
+  if summary['median'] == 0:
+    return 0
+  return (summary['ci_high'] - summary['ci_low']) / summary['median'] * 100
+
+
+def add_sampling_arguments(parser, runs):
+  parser.add_argument('--warmup', type=int, default=0,
+                      help='number of unmeasured warm-up runs')
+  parser.add_argument('--runs', type=int, default=runs,
+                      help='number of measured runs')
+  parser.add_argument('--target-ci', type=float, metavar='PERCENT',
+                      help='keep sampling until the width of the 95%% '
+                           'confidence interval of the median drops below '
+                           'PERCENT of the median')
+  parser.add_argument('--max-runs', type=int, default=30,
+                      help='maximum number of measured runs with --target-ci')
+
+
+def sample(measure, get_time, options):
+  """Calls measure repeatedly according to the sampling options.
+
+  Returns a list of results of the measured runs and the summary of the times
+  extracted from them with get_time.
+  """
+  for i in range(options.warmup):
+    measure()
+  results = []
+  min_runs = options.runs
+  if options.target_ci is not None:
+    # A confidence interval estimated from fewer runs is meaningless.
+    min_runs = max(min_runs, 3)
+  while True:
+    results.append(measure())
+    if len(results) < min_runs:
+      continue
+    summary = summarize([get_time(r) for r in results])
+    if options.target_ci is None or len(results) >= options.max_runs or \
+       ci_width(summary) <= options.target_ci:
+      return results, summary
+
+
+def sampling_key(options):
+  """Returns a cache key part describing the sampling options"""
+  return 'warmup={} runs={} target_ci={} max_runs={}'.format(
+    options.warmup, options.runs, options.target_ci, options.max_runs)
+
+
+def compiler_identity(compiler_path):
+  """Returns a string identifying the compiler and its version"""
+  version = check_output([compiler_path, '--version']).decode()
+  return os.path.realpath(compiler_path) + '\n' + version
+
+
+def hash_files(filenames):
+  """Returns a list of content hashes of files"""
+  hashes = []
+  for filename in filenames:
+    with open(filename, 'rb') as f:
+      hashes.append(hashlib.sha256(f.read()).hexdigest())
+  return hashes
+
+
+def library_files(compiler_path, flags):
+  """Returns the paths of the libraries linked with flags that can be found
+  in the -L directories or the compiler's library search path"""
+  dirs = [f[2:] for f in flags if f.startswith('-L')]
+  libraries = []
+  for flag in flags:
+    if flag.endswith(('.a', '.so', '.dylib')) and os.path.exists(flag):
+      libraries.append(os.path.realpath(flag))
+    if not flag.startswith('-l'):
+      continue
+    for filename in ['lib' + flag[2:] + ext for ext in ('.so', '.dylib', '.a')]:
+      paths = [os.path.join(d, filename) for d in dirs] + [check_output(
+        [compiler_path, '-print-file-name=' + filename]).decode().strip()]
+      path = next((p for p in paths if os.path.isfile(p)), None)
+      if path:
+        libraries.append(os.path.realpath(path))
+        break
+  return libraries
+
+
+def dependency_files(compiler_path, sources, flags):
+  """Returns the headers included by sources when compiled with flags as
+  reported by compiler_path -M, including system headers, followed by the
+  libraries linked with flags."""
+  command = [compiler_path, '-M'] + list(sources) + \
+    without_time_report(split_flags(flags))
+  rules = check_output(command).decode().replace('\\\n', ' ')
+  headers = set()
+  for rule in rules.splitlines():
+    if ':' not in rule:
+      continue
+    headers.update(os.path.realpath(d) for d in rule.split(':', 1)[1].split())
+  headers.difference_update(os.path.realpath(s) for s in sources)
+  return sorted(headers) + library_files(compiler_path, flags)
+
+
+class ArtifactCache:
+  """A content-addressed cache of build artifacts and their measurements.
+
+  Each entry is a directory named after the hash of everything that affects
+  the build (generated sources, included headers, linked libraries, flags and
+  compiler identity) containing the artifact files and a result.json file
+  with the measured results. Entries are evicted in least recently used order
+  when the total size of the cache exceeds max_size bytes.
+  """
+
+  RESULT_FILENAME = 'result.json'
+
+  def __init__(self, directory, max_size):
+    self.directory = directory
+    self.max_size = max_size
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.evict()
+
+  @staticmethod
+  def key(*parts):
+    """Returns a key for the given parts which can be strings or lists of
+    strings"""
+    h = hashlib.sha256()
+    for part in parts:
+      if isinstance(part, (list, tuple)):
+        part = '\0'.join(part)
+      h.update(part.encode('utf-8'))
+      h.update(b'\1')
+    return h.hexdigest()
+
+  def get(self, key):
+    """Returns a (path, result) pair for the entry with the given key or None
+    if there is no such entry"""
+    path = os.path.join(self.directory, key)
+    try:
+      with open(os.path.join(path, self.RESULT_FILENAME)) as f:
+        result = json.load(f)
+      # Mark the entry as recently used.
+      os.utime(path, None)
+    except (IOError, OSError, ValueError):
+      return None
+    return path, result
+
+  def put(self, key, files, result):
+    """Stores files, a dict mapping entry file names to paths, and a
+    JSON-serializable result under the given key"""
+    tmp_path = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+    for name, filename in files.items():
+      shutil.copy2(filename, os.path.join(tmp_path, name))
+    with open(os.path.join(tmp_path, self.RESULT_FILENAME), 'w') as f:
+      json.dump(result, f)
+    path = os.path.join(self.directory, key)
+    if os.path.exists(path):
+      shutil.rmtree(path, ignore_errors=True)
+    try:
+      os.rename(tmp_path, path)
+    except OSError:
+      # Another process has stored the same entry concurrently.
+      shutil.rmtree(tmp_path, ignore_errors=True)
+    self.evict()
+
+  def evict(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      path = os.path.join(self.directory, name)
+      if name.startswith('.') or not os.path.isdir(path):
+        continue
+      try:
+        size = sum(os.path.getsize(os.path.join(path, f))
+                   for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+      except OSError:
+        continue
+    total_size = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+      if total_size <= self.max_size:
+        break
+      shutil.rmtree(path, ignore_errors=True)
+      total_size -= size
+
+
+def add_cache_arguments(parser):
+  parser.add_argument('--cache-dir', default='.bench-cache',
+                      help='directory of the build artifact cache')
+  parser.add_argument('--cache-size', type=int, default=1024,
+                      help='maximum size of the build artifact cache in MiB')
+  parser.add_argument('--no-cache', action='store_true',
+                      help="don't use the build artifact cache")
+  parser.add_argument('--cold', action='store_true',
+                      help='rebuild and time everything even if a cached '
+                           'build exists, results are still stored in the '
+                           'cache')
+
+
+def open_cache(options):
+  """Returns the artifact cache configured by options or None if disabled"""
+  if options.no_cache:
+    return None
+  return ArtifactCache(os.path.abspath(options.cache_dir),
+                       options.cache_size * 1024 * 1024)
+
+
+# Version of the results file format, incremented on incompatible changes.
+RESULTS_VERSION = 1
+
+# Default results file shared by all benchmark scripts.
+DEFAULT_RESULTS_FILENAME = 'results.jsonl'
+
+
+def compiler_version(compiler_path):
+  return check_output([compiler_path, '--version']).decode().splitlines()[0]
+
+
+class ResultsWriter:
+  """Appends benchmark results to a JSON Lines file.
+
+  Each line is a self-contained JSON object describing one measured run of
+  one method/config/argument count together with information about the
+  session, host and compiler so that results from many runs can be stored in
+  the same file and loaded without unpickling arbitrary objects.
+  """
+
+  def __init__(self, filename, script, compiler_path=None):
+    self.filename = filename
+    now = time.time()
+    self.common = {
+      'version': RESULTS_VERSION,
+      'script': script,
+      'session': '{}-{}'.format(
+        time.strftime('%Y%m%dT%H%M%S', time.localtime(now)), os.getpid()),
+      'timestamp': now,
+      'host': platform.node(),
+      'platform': platform.platform(),
+      'cpu_count': default_jobs()
+    }
+    if compiler_path:
+      self.common['compiler'] = os.path.realpath(compiler_path)
+      self.common['compiler_version'] = compiler_version(compiler_path)
+
+  def write(self, rows):
+    """Writes rows which are dicts of per-run fields"""
+    with open(self.filename, 'a') as f:
+      for row in rows:
+        record = dict(self.common)
+        record.update(row)
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def load_results(filename):
+  """Returns a list of rows stored in a results file"""
+  rows = []
+  with open(filename) as f:
+    for line_number, line in enumerate(f, 1):
+      if not line.strip():
+        continue
+      row = json.loads(line)
+      if row.get('version') != RESULTS_VERSION:
+        raise Exception('{}:{}: unsupported results version {}'.format(
+          filename, line_number, row.get('version')))
+      rows.append(row)
+  return rows
+
+
+def latest_sessions(rows):
+  """Returns the rows of the most recent session of each script"""
+  latest = {}
+  for row in rows:
+    script = row['script']
+    if script not in latest or row['timestamp'] > latest[script][0]:
+      latest[script] = (row['timestamp'], row['session'])
+  sessions = set(session for _, session in latest.values())
+  return [r for r in rows if r['session'] in sessions]
+
+
+def group_runs(rows):
+  """Groups rows by script, method, config and arguments which are the
+  argument count or a tuple such as (size, digits) for a sweep"""
+  groups = {}
+  for row in rows:
+    args = row.get('args')
+    if isinstance(args, list):
+      # Lists such as [size, digits] are stored by sweeps.
+      args = tuple(args)
+    key = (row['script'], row['method'], row['config'], args)
+    groups.setdefault(key, []).append(row)
+  return groups
+
+
+def find_regressions(baseline_rows, rows, time_threshold, size_threshold):
+  """Returns regressions of rows relative to baseline_rows.
+
+  A compile time regression is reported if the median time has increased by
+  more than time_threshold percent and the 95% confidence intervals of the
+  baseline and new medians don't overlap so that noise is not reported as a
+  regression. Sizes are deterministic and are compared with size_threshold
+  only. Each regression is a dict with the group key, the metric, baseline
+  and new values and the relative change in percent.
+  """
+  baseline_groups = group_runs(baseline_rows)
+  regressions = []
+  for key, runs in group_runs(rows).items():
+    baseline_runs = baseline_groups.get(key)
+    if not baseline_runs:
+      continue
+    old = summarize([r['time'] for r in baseline_runs])
+    new = summarize([r['time'] for r in runs])
+    if old['median'] > 0:
+      change = (new['median'] / old['median'] - 1) * 100
+      if change > time_threshold and new['ci_low'] > old['ci_high']:
+        regressions.append({'key': key, 'metric': 'time',
+                            'baseline': old['median'], 'value': new['median'],
+                            'change': change})
+    for metric in 'size', 'stripped_size':
+      old_size = baseline_runs[0].get(metric)
+      new_size = runs[0].get(metric)
+      if not old_size or new_size is None:
+        continue
+      change = (new_size / old_size - 1) * 100
+      if change > size_threshold:
+        regressions.append({'key': key, 'metric': metric,
+                            'baseline': old_size, 'value': new_size,
+                            'change': change})
+  regressions.sort(key=lambda r: r['change'], reverse=True)
+  return regressions
@@ -1,15 +1,71 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Script to test how much bloating a large project will suffer when using
 # different formatting methods.
 # Based on bloat_test.sh from https://github.com/c42f/tinyformat.
 
 from __future__ import print_function
-import os, re, sys
-from contextlib import nested
+import argparse, itertools, math, os, re, shutil, sys
 from glob import glob
-from subprocess import check_call, Popen, PIPE
-from timeit import timeit
+from subprocess import check_call
+from timeit import default_timer
+
+import benchutil
+
+parser = argparse.ArgumentParser(
+  usage='%(prog)s [options] [compiler flags]')
+parser.add_argument('-j', '--jobs', type=int, default=benchutil.default_jobs(),
+                    help='number of translation units to compile in parallel')
+parser.add_argument('--breakdown', action='store_true',
+                    help='report compile time, peak memory usage and section '
+                         'sizes per translation unit')
+parser.add_argument('--symbols', type=int, default=0, metavar='N',
+                    help='attribute the size of the unstripped executable to '
+                         'namespaces and list the N largest symbols')
+parser.add_argument('--time-report', action='store_true',
+                    help='report the compile time per compiler phase using '
+                         '-ftime-report (GCC) or -ftime-trace (clang), this '
+                         'adds some overhead to the measured compile time')
+parser.add_argument('--headers', default='include',
+                    help='comma-separated list of the ways the headers of '
+                         'each method are used: include (in each TU), pch '
+                         '(precompiled header) or header-unit (C++20 header '
+                         'unit)')
+parser.add_argument('--ccache', action='store_true',
+                    help='build through ccache with a private cache and '
+                         'measure a cold build filling the cache, a warm '
+                         'build hitting it and the cache size, the artifact '
+                         'cache is not used')
+parser.add_argument('--linkers', default='default',
+                    help='comma-separated list of linkers to link each method '
+                         'with in addition to the regular build: default, '
+                         'bfd, gold, lld, mold or all available ones')
+parser.add_argument('--lto', default='none',
+                    help='comma-separated list of link-time optimization '
+                         'modes to link each method with: none, full (-flto) '
+                         'or thin (-flto=thin, clang only)')
+parser.add_argument('--incremental', action='store_true',
+                    help='after the full build, repeatedly change a literal '
+                         'in one translation unit, rebuild its object and '
+                         'relink, and report the latency of this edit cycle')
+benchutil.add_sampling_arguments(parser, runs=1)
+benchutil.add_cache_arguments(parser)
+parser.add_argument('--output', default=benchutil.DEFAULT_RESULTS_FILENAME,
+                    help='results file to append to')
+options, more_compiler_flags = parser.parse_known_args(sys.argv[1:])
+header_modes = benchutil.parse_header_modes(parser, options.headers)
+ccache_path = None
+if options.ccache:
+  ccache_path = benchutil.find_program('ccache')
+  if not ccache_path:
+    parser.error('ccache not found')
+  if options.time_report:
+    parser.error('--ccache cannot be combined with --time-report because '
+                 'ccache replays the time report of cached compilations')
+  if header_modes != ['include']:
+    parser.error('--ccache only supports --headers include')
+# The artifact cache would skip the builds measured in ccache mode.
+cache = None if options.ccache else benchutil.open_cache(options)
 
 template = r'''
 #ifdef USE_BOOST
@@ -485,88 +541,289 @@ void doFormat_d() {
 #endif
 '''
 
+
 prefix = '_bloat_test_tmp_'
 num_translation_units = 100
 
-# Remove old files.
-filenames = glob(prefix + '??.cc')
-for f in [prefix + 'main.cc', prefix + 'all.h']:
-  if os.path.exists(f):
-    filenames.append(f)
-for f in filenames:
-  os.remove(f)
-
-# Generate all the files.
-main_source = prefix + 'main.cc'
-main_header = prefix + 'all.h'
-sources = [main_source]
-with nested(open(main_source, 'w'), open(main_header, 'w')) as \
-     (main_file, header_file):
-  main_file.write(re.sub('^ +', '', '''
-    #include "{}all.h"
-
-    int main() {{
-    '''.format(prefix), 0, re.MULTILINE))
-  for i in range(num_translation_units):
-    n = '{:03}'.format(i)
-    source = prefix + n + '.cc'
-    sources.append(source)
-    with open(source, 'w') as f:
-      if i == 0:
-        f.write('#define FIRST_FILE\n')
-      text = template
-      for p in ["a", "b", "c", "d"]:
-        func_name = 'doFormat_{}{}'.format(p, n)
-        text = text.replace('doFormat_{}'.format(p), func_name).replace('42', str(i))
+# Directory of the headers precompiled in pch and header-unit modes.
+headers_dir = os.path.abspath(prefix + 'headers')
+# Private ccache directory emptied before each cold build.
+ccache_dir = os.path.abspath(prefix + 'ccache')
+
+def remove_old_files():
+  filenames = glob(prefix + '??.cc') + glob(prefix + '*.o')
+  for f in [prefix + 'main.cc', prefix + 'all.h']:
+    if os.path.exists(f):
+      filenames.append(f)
+  for f in filenames:
+    os.remove(f)
+  for d in headers_dir, ccache_dir:
+    if os.path.exists(d):
+      shutil.rmtree(d)
+
+def function_names(i):
+  return ['doFormat_{}{:03}'.format(p, i) for p in ["a", "b", "c", "d"]]
+
+# Writes the source of the i-th translation unit that formats value, which is
+# i unless the source is edited.
+def write_source(source, i, value=None):
+  with open(source, 'w') as f:
+    if i == 0:
+      f.write('#define FIRST_FILE\n')
+    f.write(benchutil.HEADER_UNIT_PRELUDE)
+    text = template.replace('42', str(i if value is None else value))
+    for p, func_name in zip(["a", "b", "c", "d"], function_names(i)):
+      text = text.replace('doFormat_{}'.format(p), func_name)
+    f.write(text)
+
+def generate_files():
+  main_source = prefix + 'main.cc'
+  main_header = prefix + 'all.h'
+  sources = [main_source]
+  with open(main_source, 'w') as main_file, \
+       open(main_header, 'w') as header_file:
+    main_file.write(re.sub('^ +', '', '''
+      #include "{}all.h"
+
+      int main() {{
+      '''.format(prefix), 0, re.MULTILINE))
+    for i in range(num_translation_units):
+      source = prefix + '{:03}'.format(i) + '.cc'
+      sources.append(source)
+      write_source(source, i)
+      for func_name in function_names(i):
         main_file.write(func_name + '();\n')
         header_file.write('void ' + func_name + '();\n')
-      f.write(text)
-  main_file.write('}')
-
-# Find compiler.
-compiler_path = None
-for path in os.getenv('PATH').split(os.pathsep):
-  filename = os.path.join(path, 'g++')
-  if os.path.exists(filename):
-    if os.path.islink(filename) and \
-       os.path.basename(os.path.realpath(filename)) == 'ccache':
-      # Don't use ccache.
-      print('Ignoring ccache link at', filename)
-      continue
-    compiler_path = filename
-    break
-print('Using compiler', filename)
+    main_file.write('}')
+  return sources
+
+def find_compiler():
+  compiler_path = None
+  for path in os.getenv('PATH').split(os.pathsep):
+    filename = os.path.join(path, 'g++')
+    if os.path.exists(filename):
+      if os.path.islink(filename) and \
+         os.path.basename(os.path.realpath(filename)) == 'ccache':
+        # Don't use ccache.
+        print('Ignoring ccache link at', filename)
+        continue
+      compiler_path = filename
+      break
+  return compiler_path
 
 class Result:
   pass
 
-# Measure compile time and executable size.
-expected_output = None
-def benchmark(flags):
-  output_filename = prefix + '.out'
-  if os.path.exists(output_filename):
-    os.remove(output_filename)
-  include_dir = '-I' + os.path.dirname(os.path.realpath(__file__))
-  command = [compiler_path, '-std=c++17', '-o', output_filename, include_dir] + sources + flags
-  #print(" ".join(command))
-  command = "check_call({})".format(command)
+# Measure compile time and executable size. In ccache mode the build starts
+# with an empty cache and is followed by a warm build hitting the cache.
+def measure(compiler_path, sources, flags, output_filename, stripped_filename):
+  launcher, env = [], None
+  if options.ccache:
+    if os.path.exists(ccache_dir):
+      shutil.rmtree(ccache_dir)
+    os.makedirs(ccache_dir)
+    launcher, env = [ccache_path], benchutil.ccache_env(ccache_dir)
+  build_result = benchutil.build(
+    compiler_path, sources, output_filename, flags, options.jobs,
+    options.time_report, launcher, env)
   result = Result()
-  result.time = timeit(
-    command, setup = 'from subprocess import check_call', number = 1)
-  print('Compile time: {:.2f}s'.format(result.time))
+  result.time = build_result['cpu_time']
+  result.wall_time = build_result['wall_time']
+  result.link_time = build_result['link']['cpu_time']
+  result.link_max_rss = build_result['link']['max_rss']
+  if options.ccache:
+    result.ccache_size = benchutil.directory_size(ccache_dir)
+    warm_result = benchutil.build(
+      compiler_path, sources, output_filename, flags, options.jobs,
+      launcher=launcher, env=env)
+    result.warm_time = warm_result['cpu_time']
+    result.warm_wall_time = warm_result['wall_time']
+  if options.time_report:
+    result.phases = build_result['phases']
+  if options.breakdown:
+    # Skip the main source, only the generated TUs are of interest.
+    units = build_result['units'][1:]
+    sizes = benchutil.section_sizes([u['object'] for u in units])
+    result.units = [
+      {'time': u['cpu_time'], 'max_rss': u['max_rss'],
+       'text': text, 'data': data, 'bss': bss}
+      for u, (text, data, bss) in zip(units, sizes)]
   result.size = os.stat(output_filename).st_size
+  check_call(['strip', '-o', stripped_filename, output_filename])
+  result.stripped_size = os.stat(stripped_filename).st_size
+  return result
+
+# Measure repeatedly according to the sampling options and summarize.
+def measure_samples(compiler_path, sources, flags, output_filename,
+                    stripped_filename):
+  samples, summary = benchutil.sample(
+    lambda: measure(compiler_path, sources, flags, output_filename,
+                    stripped_filename),
+    lambda r: r.time, options)
+  result = samples[-1]
+  for r in samples:
+    if r.size != result.size or r.stripped_size != result.stripped_size:
+      raise Exception('size mismatch')
+  result.time = summary['median']
+  result.time_mad = summary['mad']
+  result.time_ci = (summary['ci_low'], summary['ci_high'])
+  result.time_samples = summary['samples']
+  result.wall_time_samples = [r.wall_time for r in samples]
+  result.wall_time = benchutil.median(result.wall_time_samples)
+  result.link_time_samples = [r.link_time for r in samples]
+  result.link_time = benchutil.median(result.link_time_samples)
+  result.link_max_rss = benchutil.median([r.link_max_rss for r in samples])
+  if options.ccache:
+    result.warm_time_samples = [r.warm_time for r in samples]
+    result.warm_time = benchutil.median(result.warm_time_samples)
+    result.warm_wall_time = benchutil.median(
+      [r.warm_wall_time for r in samples])
+  if options.breakdown:
+    for i, unit in enumerate(result.units):
+      for key in 'time', 'max_rss':
+        unit[key] = benchutil.median([r.units[i][key] for r in samples])
+  if options.time_report:
+    for phase in result.phases:
+      result.phases[phase] = benchutil.median(
+        [r.phases.get(phase, 0) for r in samples])
+  return result
+
+# Measures the latency of editing a source after a full build: a literal in a
+# translation unit in the middle is changed, its object rebuilt and the
+# executable relinked. The source is restored afterwards.
+def measure_incremental(compiler_path, sources, flags):
+  index = num_translation_units // 2
+  source = sources[index + 1]
+  objects = [benchutil.object_filename(s) for s in sources]
+  output_filename = prefix + '.incremental.out'
+  # Each edit formats a different value so that every rebuild sees a change.
+  values = itertools.count(index + num_translation_units,
+                           num_translation_units)
+
+  def edit():
+    write_source(source, index, next(values))
+    start = default_timer()
+    unit = benchutil.compile_objects(
+      compiler_path, [source], flags, 1, options.time_report)[0]
+    link_result = benchutil.link(compiler_path, objects, output_filename,
+                                 flags)
+    return {'wall_time': default_timer() - start,
+            'cpu_time': unit['cpu_time'] + link_result['cpu_time'],
+            'compile_time': unit['cpu_time'],
+            'link_time': link_result['cpu_time']}
+
+  try:
+    samples, summary = benchutil.sample(edit, lambda r: r['cpu_time'], options)
+  finally:
+    write_source(source, index)
+  result = {'time': summary['median'], 'time_mad': summary['mad'],
+            'time_samples': summary['samples']}
+  for key in 'wall_time', 'compile_time', 'link_time':
+    result[key] = benchutil.median([r[key] for r in samples])
+  return result
+
+expected_output_digest = None
+def benchmark(compiler_path, sources, flags, method, mode, link_combinations):
+  output_filename = prefix + '.out'
+  stripped_filename = prefix + '.stripped.out'
+  include_dir = '-I' + os.path.dirname(os.path.realpath(__file__))
+  flags = ['-std=c++17', include_dir] + flags
+  if options.time_report:
+    flags += benchutil.time_report_flags(compiler_path)
+  headers = [prefix + 'all.h']
+  mode_flags = []
+  if mode != 'include':
+    header = os.path.join(headers_dir, re.sub(r'\W', '_', method),
+                          'precompiled.h')
+    benchutil.write_header(header, method_headers[method])
+    headers.append(header)
+    mode_flags = benchutil.header_mode_flags(compiler_path, header, mode)
+  entry = None
+  if cache:
+    # The remaining TUs include the same headers as the last one scanned.
+    dependencies = benchutil.dependency_files(compiler_path, sources[:3], flags)
+    key = cache.key(benchutil.hash_files(sources + headers),
+                    benchutil.hash_files(dependencies),
+                    flags + mode_flags,
+                    benchutil.compiler_identity(compiler_path),
+                    benchutil.sampling_key(options))
+    if not options.cold:
+      entry = cache.get(key)
+    if entry and options.breakdown and 'units' not in entry[1]:
+      entry = None
+    if entry and 'link_time' not in entry[1]:
+      entry = None
+    if entry and options.incremental and not entry[1].get('incremental'):
+      entry = None
+    if entry and link_combinations and \
+       [[l['linker'], l['lto']] for l in entry[1].get('links') or []] != \
+       link_combinations:
+      entry = None
+  if entry:
+    path, data = entry
+    shutil.copy(os.path.join(path, 'a.out'), output_filename)
+    shutil.copy(os.path.join(path, 'stripped.out'), stripped_filename)
+    result = Result()
+    result.__dict__.update(data)
+    result.cached = True
+    print('Using cached build from', path)
+  else:
+    # The header is precompiled once and reused by all samples.
+    precompiled = None
+    if mode != 'include':
+      precompiled = benchutil.precompile_header(
+        compiler_path, header, flags, mode)
+    result = measure_samples(compiler_path, sources, flags + mode_flags,
+                             output_filename, stripped_filename)
+    # The objects of the full build are reused by incremental builds and
+    # replaced by link_matrix.
+    result.incremental = None
+    if options.incremental:
+      result.incremental = measure_incremental(
+        compiler_path, sources, flags + mode_flags)
+    result.links = benchutil.link_matrix(
+      compiler_path, sources, flags + mode_flags, options.jobs,
+      link_combinations, prefix + '.link.out', options)
+    result.pch_time = precompiled['cpu_time'] if precompiled else None
+    result.pch_size = precompiled['size'] if precompiled else None
+    result.cached = False
+    if cache:
+      cache.put(key, {'a.out': output_filename,
+                      'stripped.out': stripped_filename}, vars(result))
+  result.flags = flags + mode_flags
+  if getattr(result, 'pch_time', None) is not None:
+    print('Precompiled header build time: {:.2f}s, size: {}'.format(
+      result.pch_time, result.pch_size))
+  print('Compile time: {:.2f}s (MAD: {:.2f}s, 95% CI: {:.2f}-{:.2f}s, '
+        'runs: {}, wall time: {:.2f}s)'.format(
+          result.time, result.time_mad, result.time_ci[0], result.time_ci[1],
+          len(result.time_samples), result.wall_time))
+  if options.ccache:
+    print('Warm compile time: {:.2f}s (wall time: {:.2f}s), ccache size: '
+          '{}'.format(result.warm_time, result.warm_wall_time,
+                      result.ccache_size))
+  print('Link time: {:.2f}s, link peak memory: {:.0f} KiB'.format(
+    result.link_time, result.link_max_rss))
+  if options.incremental:
+    print('Incremental rebuild time: {:.2f}s (MAD: {:.2f}s, runs: {})'.format(
+      result.incremental['time'], result.incremental['time_mad'],
+      len(result.incremental['time_samples'])))
   print('Size: {}'.format(result.size))
-  check_call(['strip', output_filename])
-  result.stripped_size = os.stat(output_filename).st_size
   print('Stripped size: {}'.format(result.stripped_size))
-  p = Popen(['./' + output_filename], stdout=PIPE,
-            env={'LD_LIBRARY_PATH': 'fmt'})
-  output = p.communicate()[0]
-  global expected_output
-  if not expected_output:
-    expected_output = output
-  elif output != expected_output:
-    raise Exception("output doesn't match")
+  if options.symbols:
+    symbols = benchutil.symbol_sizes(output_filename)
+    result.namespaces = benchutil.namespace_sizes(symbols)
+    result.top_symbols = symbols[::-1][:options.symbols]
+  output_digest = benchutil.output_digest(
+    ['./' + stripped_filename], env={'LD_LIBRARY_PATH': 'fmt'})
+  global expected_output_digest
+  if not expected_output_digest:
+    expected_output_digest = output_digest
+  elif output_digest != expected_output_digest:
+    raise Exception("output doesn't match: {} bytes with SHA-256 {} expected, "
+                    "{} bytes with SHA-256 {} produced".format(
+                      expected_output_digest[1], expected_output_digest[0],
+                      output_digest[1], output_digest[0]))
   sys.stdout.flush()
   return result
 
@@ -593,6 +850,21 @@ methods = [
   ('pformat' , ['-DUSE_PFORMAT'])
 ]
 
+# Headers of each method that are precompiled in pch and header-unit modes.
+method_headers = {
+  'printf'       : ['<stdio.h>'],
+  'printf+string': ['<string>', '<stdio.h>'],
+  'IOStreams'    : ['<iostream>'],
+  'fmt'          : ['"fmt/core.h"'],
+  'compiled_fmt' : ['"fmt/core.h"'],
+  'tinyformat'   : ['"tinyformat.h"'],
+  'Boost Format' : ['<boost/format.hpp>', '<iostream>'],
+  'Folly Format' : ['<folly/Format.h>', '<iostream>'],
+  # stb_sprintf.h depends on macros defined in the TUs that include it.
+  'stb_sprintf'  : ['<stdio.h>'],
+  'pformat'      : ['<pformat/pformat.h>', '<stdio.h>']
+}
+
 def format_field(field, format = '', width = ''):
   return '{:{}{}}'.format(field, width, format)
 
@@ -623,28 +895,193 @@ def print_table(table, *formats):
 def to_kib(n):
   return int(round(n / 1024.0))
 
-NUM_RUNS = 1
-for config, flags in configs:
-  results = {}
-  for i in range(NUM_RUNS):
+breakdown_metrics = [
+  ('time', 'Compile time, s', '.2f', 1),
+  ('max_rss', 'Peak RSS, MiB', '.1f', 1024.0),
+  ('text', 'Text, B', '.0f', 1),
+  ('data', 'Data, B', '.0f', 1),
+  ('bss', 'BSS, B', '.0f', 1)
+]
+
+# Prints the distribution of per-TU measurements. The first TU is shown
+# separately because it contains extra code such as the stb_sprintf
+# implementation.
+def print_breakdown(results):
+  for key, title, format, scale in breakdown_metrics:
+    table = [(title, 'First TU', 'Min', 'Median', 'P95', 'Max')]
     for method, method_flags in methods:
-      print('Benchmarking', config, method)
-      sys.stdout.flush()
-      new_result = benchmark(flags + method_flags + sys.argv[1:])
-      if method not in results:
-        results[method] = new_result
-        continue
-      old_result = results[method]
-      old_result.time = min(old_result.time, new_result.time)
-      if new_result.size != old_result.size or \
-         new_result.stripped_size != old_result.stripped_size:
-        raise Exception('size mismatch')
+      values = [u[key] / scale for u in results[method].units]
+      table.append((method, values[0]) + benchutil.distribution(values))
+    print_table(table, '', *([format] * 5))
+
+# Prints the compile time of the phases that take the most time overall.
+def print_phases(results):
+  phases = benchutil.top_phases([r.phases for r in results.values()], 10)
+  table = [('Phase, s',) + tuple(method for method, method_flags in methods)]
+  for phase in phases:
+    table.append((phase,) + tuple(results[method].phases.get(phase, 0)
+                                  for method, method_flags in methods))
+  print_table(table, '', *(['.2f'] * len(methods)))
+
+# Prints the executable size by namespace and the largest symbols.
+def print_symbols(results):
+  sizes = {}
+  for result in results.values():
+    for namespace, size in result.namespaces.items():
+      sizes[namespace] = sizes.get(namespace, 0) + size
+  table = [('Namespace, KiB',) +
+           tuple(method for method, method_flags in methods)]
+  for namespace in sorted(sizes, key=sizes.get, reverse=True):
+    table.append(
+      (namespace + '::' if namespace else '(global)',) +
+      tuple(to_kib(results[method].namespaces.get(namespace, 0))
+            for method, method_flags in methods))
+  print_table(table, *([''] * (len(methods) + 1)))
+  for method, method_flags in methods:
+    print(method, 'largest symbols:')
+    table = [('Size, B', 'Symbol')]
+    for size, name in results[method].top_symbols:
+      table.append((size, name))
+    print_table(table, '', '')
+
+# Prints the link time, peak memory usage of the linker and executable size of
+# each method per linker and LTO mode.
+def print_links(results):
+  table = [('Method', 'Linker', 'LTO', 'Compile Time, s', 'Link Time, s',
+            'Link Wall Time, s', 'Link Peak RSS, MiB', 'Executable size, KiB',
+            'Stripped size, KiB')]
+  for method, method_flags in methods:
+    for link in results[method].links:
+      table.append((method, link['linker'], link['lto'], link['compile_time'],
+                    link['time'], link['wall_time'], link['max_rss'] / 1024.0,
+                    to_kib(link['size']), to_kib(link['stripped_size'])))
+  print_table(table, '', '', '', '.1f', '.2f', '.2f', '.1f', '', '')
+
+# Prints the latency of rebuilding after an edit to one translation unit.
+def print_incremental(results):
+  table = [('Method', 'Rebuild Time, s', 'MAD, s', 'Compile Time, s',
+            'Link Time, s', 'Wall Time, s')]
+  for method, method_flags in methods:
+    incremental = results[method].incremental
+    table.append((method, incremental['time'], incremental['time_mad'],
+                  incremental['compile_time'], incremental['link_time'],
+                  incremental['wall_time']))
+  print_table(table, '', '.2f', '.2f', '.2f', '.2f', '.2f')
+
+# Prints the cold and warm ccache build times and the cache size.
+def print_ccache(config, results):
+  print(config, 'ccache:')
+  table = [('Method', 'Cold Time, s', 'Warm Time, s', 'Speedup',
+            'Cache size, KiB')]
+  for method, method_flags in methods:
+    result = results[method]
+    table.append((method, result.time, result.warm_time,
+                  '{:.1f}x'.format(result.time / result.warm_time),
+                  to_kib(result.ccache_size)))
+  print_table(table, '', '.1f', '.2f', '', '')
+
+# Prints the results of config and writes them to the results file.
+def print_results(writer, config, results):
   print(config, 'Results:')
   table = [
-    ('Method', 'Compile Time, s', 'Executable size, KiB', 'Stripped size, KiB')
+    ('Method', 'Compile Time, s', 'MAD, s', '95% CI, s', 'Wall Time, s',
+     'Link Time, s', 'Executable size, KiB', 'Stripped size, KiB')
   ]
   for method, method_flags in methods:
     result = results[method]
     table.append(
-      (method, result.time, to_kib(result.size), to_kib(result.stripped_size)))
-  print_table(table, '', '.1f', '', '')
+      (method, result.time, result.time_mad,
+       '{:.1f}-{:.1f}'.format(*result.time_ci), result.wall_time,
+       result.link_time, to_kib(result.size), to_kib(result.stripped_size)))
+  print_table(table, '', '.1f', '.2f', '', '.1f', '.2f', '', '')
+  if any(results[method].links for method, method_flags in methods):
+    print(config, 'Linkers:')
+    print_links(results)
+  if options.incremental:
+    print(config, 'Incremental rebuild of one translation unit:')
+    print_incremental(results)
+  if options.ccache:
+    print_ccache(config, results)
+  for method, method_flags in methods:
+    result = results[method]
+    warm_time_samples = getattr(result, 'warm_time_samples',
+                                [None] * len(result.time_samples))
+    link_time_samples = getattr(result, 'link_time_samples',
+                                [result.link_time] * len(result.time_samples))
+    writer.write(
+      {'method': method, 'config': config, 'args': None, 'run': run,
+       'time': time, 'wall_time': wall_time, 'size': result.size,
+       'stripped_size': result.stripped_size, 'flags': result.flags,
+       'phases': getattr(result, 'phases', None),
+       'namespaces': getattr(result, 'namespaces', None),
+       'num_translation_units': num_translation_units,
+       'pch_time': getattr(result, 'pch_time', None),
+       'pch_size': getattr(result, 'pch_size', None),
+       'warm_time': warm_time,
+       'ccache_size': getattr(result, 'ccache_size', None),
+       'link_time': link_time, 'link_max_rss': result.link_max_rss,
+       'links': result.links,
+       'incremental': getattr(result, 'incremental', None),
+       'cached': result.cached}
+      for run, (time, wall_time, warm_time, link_time) in enumerate(
+        zip(result.time_samples, result.wall_time_samples,
+            warm_time_samples, link_time_samples)))
+  if options.breakdown:
+    print(config, 'Per translation unit:')
+    print_breakdown(results)
+  if options.time_report:
+    print(config, 'Compile time by phase:')
+    print_phases(results)
+  if options.symbols:
+    print(config, 'Executable size by namespace:')
+    print_symbols(results)
+
+# Prints the cost of precompiling the headers of each method and the compile
+# time saved per TU compared to including them.
+def print_precompiled(results):
+  table = [('Method', 'Headers', 'Build time, s', 'Size, KiB',
+            'Compile Time, s', 'Saving per TU, ms', 'Break-even TUs')]
+  for method, method_flags in methods:
+    for mode in header_modes:
+      if mode == 'include':
+        continue
+      result = results[mode][method]
+      saving, break_even = '', ''
+      if 'include' in results:
+        saving = (results['include'][method].time - result.time) / \
+                 num_translation_units
+        if saving > 0:
+          break_even = '{:.0f}'.format(math.ceil(result.pch_time / saving))
+        saving = '{:.1f}'.format(saving * 1000)
+      table.append((method, mode, result.pch_time, to_kib(result.pch_size),
+                    result.time, saving, break_even))
+  print_table(table, '', '', '.2f', '', '.1f', '', '')
+
+def bench():
+  remove_old_files()
+  sources = generate_files()
+  compiler_path = find_compiler()
+  print('Using compiler', compiler_path)
+  link_combinations = benchutil.parse_link_matrix(
+    parser, compiler_path, options.linkers, options.lto)
+  writer = benchutil.ResultsWriter(options.output, 'bloat-test', compiler_path)
+  for config, flags in configs:
+    results_by_mode = {}
+    for mode in header_modes:
+      label = benchutil.header_mode_config(config, mode)
+      if options.ccache:
+        label += '/ccache'
+      results = results_by_mode[mode] = {}
+      for method, method_flags in methods:
+        print('Benchmarking', label, method)
+        sys.stdout.flush()
+        results[method] = benchmark(
+          compiler_path, sources, flags + method_flags + more_compiler_flags,
+          method, mode, link_combinations)
+      print_results(writer, label, results)
+    if header_modes != ['include']:
+      print(config, 'Precompiled headers:')
+      print_precompiled(results_by_mode)
+
+if __name__ == '__main__':
+  bench()
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+
+# Script to run the Google Benchmark based runtime benchmarks and store their
+# results together with the compile-time and size results.
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from subprocess import call, check_call
+
+import benchutil
+
+# Benchmark binaries relative to the build directory. Each entry lists the
+# possible locations of a binary.
+binaries = [
+  ('int-benchmark',        ['int-benchmark']),
+  ('double-benchmark',     ['double-benchmark']),
+  ('concat-benchmark',     ['concat-benchmark']),
+  ('parse-benchmark',      ['parse-benchmark']),
+  ('locale-benchmark',     ['locale-benchmark']),
+  ('vararg-benchmark',     ['vararg-benchmark']),
+  ('find-pow10-benchmark', ['find-pow10-benchmark']),
+  ('sink-benchmark',       ['sink-benchmark']),
+  ('digits10-benchmark',   ['digits10/digits10-benchmark',
+                            'digits10-benchmark'])
+]
+
+# Events counted with --perf by default and the software events used when
+# hardware counters are not available, e.g. in virtual machines.
+hardware_events = ['cycles', 'instructions', 'branches', 'branch-misses',
+                   'cache-references', 'cache-misses']
+software_events = ['task-clock', 'page-faults', 'context-switches',
+                   'cpu-migrations']
+
+parser = argparse.ArgumentParser(
+  usage='%(prog)s command [options] [benchmark options]')
+subparsers = parser.add_subparsers(help='possible commands', dest='command')
+
+parser_run = subparsers.add_parser('run', help='run the benchmarks')
+parser_run.add_argument('benchmarks', type=str, nargs='*',
+                        help='benchmarks to run, all by default')
+parser_run.add_argument('--build-dir', type=str, default='.',
+                        help='directory containing the benchmark binaries')
+parser_run.add_argument('--repetitions', type=int, default=3,
+                        help='number of repetitions of each benchmark')
+parser_run.add_argument('--filter', type=str,
+                        help='regular expression selecting the benchmarks '
+                             'to run within each binary')
+parser_run.add_argument('--cpus', type=str,
+                        help='comma-separated list of CPUs to pin the '
+                             'benchmarks to')
+parser_run.add_argument('--perf', action='store_true',
+                        help='also run each benchmark under perf stat and '
+                             'report hardware counters per item')
+parser_run.add_argument('--perf-events', type=str,
+                        default=','.join(hardware_events),
+                        help='comma-separated list of perf events to count')
+parser_run.add_argument('--output', type=str,
+                        default=benchutil.DEFAULT_RESULTS_FILENAME,
+                        help='results file to append to')
+
+parser_sweep = subparsers.add_parser(
+  'sweep', help='run int-benchmark over a range of data sizes')
+parser_sweep.add_argument('--build-dir', type=str, default='.',
+                          help='directory containing int-benchmark')
+parser_sweep.add_argument('--sizes', type=str,
+                          default='1000,3000,10000,30000,100000,300000,'
+                                  '1000000,3000000,10000000',
+                          help='comma-separated list of value counts')
+parser_sweep.add_argument('--digits', type=str, default='0',
+                          help='comma-separated list of digit distributions: '
+                               '0 for the Karma distribution, -1 for a '
+                               'uniformly distributed number of digits or '
+                               '1 to 10 for values with that many digits')
+parser_sweep.add_argument('--repetitions', type=int, default=1,
+                          help='number of repetitions of each benchmark')
+parser_sweep.add_argument(
+  '--filter', type=str,
+  default='^(sprintf|format_to|format_int|voigt_itostr|decimal_from)/'
+          '.*/threads:1$',
+  help='regular expression selecting the methods to run, the default only '
+       'selects single-threaded runs')
+parser_sweep.add_argument('--cpus', type=str,
+                          help='comma-separated list of CPUs to pin the '
+                               'benchmark to')
+parser_sweep.add_argument('--plot', type=str, metavar='FILENAME',
+                          help='plot throughput against working set size '
+                               'into FILENAME')
+parser_sweep.add_argument('--output', type=str,
+                          default=benchutil.DEFAULT_RESULTS_FILENAME,
+                          help='results file to append to')
+
+parser_scaling = subparsers.add_parser(
+  'scaling', help='report the multithreaded scaling efficiency')
+parser_scaling.add_argument('benchmarks', type=str, nargs='*',
+                            default=['int-benchmark', 'double-benchmark',
+                                     'locale-benchmark'],
+                            help='benchmarks to run')
+parser_scaling.add_argument('--build-dir', type=str, default='.',
+                            help='directory containing the benchmark binaries')
+parser_scaling.add_argument('--repetitions', type=int, default=1,
+                            help='number of repetitions of each benchmark')
+parser_scaling.add_argument('--filter', type=str,
+                            help='regular expression selecting the benchmarks '
+                                 'to run within each binary')
+parser_scaling.add_argument('--plot', type=str, metavar='FILENAME',
+                            help='plot the efficiency against the number of '
+                                 'threads into FILENAME')
+parser_scaling.add_argument('--output', type=str,
+                            default=benchutil.DEFAULT_RESULTS_FILENAME,
+                            help='results file to append to')
+
+# Options not recognized here are passed to the benchmark binaries.
+options, more_benchmark_flags = parser.parse_known_args(sys.argv[1:])
+
+if options.command in ('sweep', 'scaling') and options.plot:
+  import matplotlib.pyplot as plt
+
+# Multipliers converting Google Benchmark time units to seconds.
+time_units = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1}
+
+# Fields of a Google Benchmark JSON entry that are not user counters.
+standard_fields = set([
+  'name', 'family_index', 'per_family_instance_index', 'run_name', 'run_type',
+  'repetitions', 'repetition_index', 'threads', 'iterations', 'real_time',
+  'cpu_time', 'time_unit', 'items_per_second', 'bytes_per_second', 'label',
+  'aggregate_name', 'aggregate_unit', 'error_occurred', 'error_message'
+])
+
+
+def find_binary(paths):
+  for path in paths:
+    filename = os.path.join(options.build_dir, path)
+    if os.path.exists(filename):
+      return filename
+  return None
+
+
+def run_benchmark(filename, flags=[], env=None):
+  """Runs a benchmark binary and returns its JSON report"""
+  fd, out_filename = tempfile.mkstemp(suffix='.json')
+  os.close(fd)
+  try:
+    command = [filename, '--benchmark_out=' + out_filename,
+               '--benchmark_out_format=json',
+               '--benchmark_repetitions={}'.format(options.repetitions)]
+    if options.filter:
+      command.append('--benchmark_filter=' + options.filter)
+    check_call(command + flags + more_benchmark_flags, env=env)
+    sys.stdout.flush()
+    with open(out_filename) as f:
+      return json.load(f)
+  finally:
+    os.remove(out_filename)
+
+
+def make_rows(name, report):
+  """Converts a Google Benchmark report into result rows, one per run"""
+  context = report.get('context', {})
+  rows = []
+  for b in report.get('benchmarks', []):
+    if b.get('run_type') == 'aggregate' or b.get('error_occurred'):
+      continue
+    unit = time_units[b.get('time_unit', 'ns')]
+    rows.append({
+      'method': b.get('run_name', b['name']),
+      'config': name,
+      'args': None,
+      'run': b.get('repetition_index', 0),
+      'time': b['real_time'] * unit,
+      'cpu_time': b['cpu_time'] * unit,
+      'iterations': b['iterations'],
+      'threads': b.get('threads', 1),
+      'items_per_second': b.get('items_per_second'),
+      'bytes_per_second': b.get('bytes_per_second'),
+      'counters': {k: v for k, v in b.items() if k not in standard_fields},
+      'mhz_per_cpu': context.get('mhz_per_cpu'),
+      'cpu_scaling_enabled': context.get('cpu_scaling_enabled'),
+      'library_build_type': context.get('library_build_type')
+    })
+  return rows
+
+
+def parse_perf_stat(filename):
+  """Parses the CSV output of perf stat -x, into a dict mapping event names
+  to counts, None for events that were not counted"""
+  counts = {}
+  with open(filename) as f:
+    for line in f:
+      fields = line.strip().split(',')
+      if line.startswith('#') or len(fields) < 3:
+        continue
+      try:
+        counts[fields[2]] = float(fields[0])
+      except ValueError:
+        # <not supported> or <not counted>
+        counts[fields[2]] = None
+  return counts
+
+
+def event_count(counts, event):
+  # perf appends :u to events when it may only count user space.
+  return counts.get(event, counts.get(event + ':u'))
+
+
+def perf_stat(events, command, stderr=None):
+  """Runs command under perf stat and returns its exit code and the counts
+  of events"""
+  fd, out_filename = tempfile.mkstemp(suffix='.csv')
+  os.close(fd)
+  try:
+    with open(os.devnull, 'w') as devnull:
+      returncode = call(['perf', 'stat', '-x,', '-o', out_filename,
+                         '-e', ','.join(events), '--'] + command,
+                        stdout=devnull, stderr=stderr)
+    return returncode, parse_perf_stat(out_filename)
+  finally:
+    os.remove(out_filename)
+
+
+def countable_events(events):
+  returncode, counts = perf_stat(events, ['true'])
+  if returncode != 0:
+    return []
+  return [e for e in events if event_count(counts, e) is not None]
+
+
+def perf_events():
+  """Returns the requested events that perf can count, falling back to
+  software events if none of them can be counted"""
+  requested = options.perf_events.split(',')
+  try:
+    events = countable_events(requested)
+  except OSError:
+    parser_run.error('--perf requires perf')
+  if not events:
+    print('Cannot count', ', '.join(requested),
+          '- using software events', file=sys.stderr)
+    events = countable_events(software_events)
+    if not events:
+      parser_run.error('perf stat cannot count any events')
+  elif len(events) < len(requested):
+    print('Cannot count', ', '.join(e for e in requested if e not in events),
+          file=sys.stderr)
+  return events
+
+
+def perf_units(b):
+  """Returns the number of items or, if the benchmark doesn't count items,
+  iterations and the name of the unit for a Google Benchmark entry"""
+  if not b.get('items_per_second'):
+    return b['iterations'], 'iteration'
+  # Rates are computed from the CPU time unless real time is used.
+  key = 'real_time' if '/real_time' in b['name'] else 'cpu_time'
+  seconds = b[key] * time_units[b.get('time_unit', 'ns')] * b['iterations']
+  return b['items_per_second'] * seconds, 'item'
+
+
+def profile_benchmarks(filename, events, rows):
+  """Runs each benchmark in rows under perf stat and stores the counts per
+  item in the rows"""
+  # Running a fixed number of iterations keeps perf from counting the runs
+  # Google Benchmark uses to pick the number of iterations, but requires
+  # Google Benchmark 1.8 or later. Each benchmark is then also run for a
+  # single iteration and the counts of that run are subtracted to remove
+  # program startup and the input data, which the benchmarks generate lazily
+  # on first use. Otherwise only the startup measured by running no
+  # benchmarks is subtracted.
+  command = [filename, '--benchmark_filter=^$'] + more_benchmark_flags
+  with open(os.devnull, 'w') as devnull:
+    returncode, startup = perf_stat(
+      events, command + ['--benchmark_min_time=1x'], stderr=devnull)
+  fixed_iterations = returncode == 0
+  if not fixed_iterations:
+    print('Counts include input generation and the iterations used to pick '
+          'the number of iterations; use Google Benchmark 1.8 or later to '
+          'exclude them', file=sys.stderr)
+    returncode, startup = perf_stat(events, command)
+  runs = {}
+  for row in rows:
+    runs.setdefault(row['method'], []).append(row)
+  for method, method_runs in runs.items():
+    command = [filename, '--benchmark_filter=^' + re.escape(method) + '$']
+    flags = []
+    baseline = startup
+    if fixed_iterations:
+      # At least one iteration is left after subtracting the baseline.
+      iterations = max(
+        int(benchutil.median([r['iterations'] for r in method_runs])), 2)
+      flags.append('--benchmark_min_time={}x'.format(iterations))
+      returncode, baseline = perf_stat(
+        events, command + more_benchmark_flags + ['--benchmark_min_time=1x'])
+      if returncode != 0:
+        print('perf stat failed for', method, file=sys.stderr)
+        continue
+    fd, out_filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+      returncode, counts = perf_stat(
+        events, command + ['--benchmark_out=' + out_filename,
+                           '--benchmark_out_format=json'] +
+        flags + more_benchmark_flags)
+      if returncode != 0:
+        print('perf stat failed for', method, file=sys.stderr)
+        continue
+      with open(out_filename) as f:
+        report = json.load(f)
+    finally:
+      os.remove(out_filename)
+    entries = [b for b in report.get('benchmarks', [])
+               if not b.get('error_occurred')]
+    if not entries:
+      continue
+    units, unit = perf_units(entries[0])
+    if fixed_iterations:
+      # The baseline includes the first iteration.
+      iterations = entries[0]['iterations']
+      if iterations < 2:
+        continue
+      units *= (iterations - 1) / iterations
+    per_unit = {}
+    for event in events:
+      count = event_count(counts, event)
+      base = event_count(baseline, event) or 0
+      if count is not None:
+        per_unit[event] = max(count - base, 0) / units
+    for row in method_runs:
+      row['perf'] = per_unit
+      row['perf_unit'] = unit
+
+
+def print_perf_results(name, events, rows):
+  table_rows = []
+  seen = set()
+  for row in rows:
+    if 'perf' not in row or row['method'] in seen:
+      continue
+    seen.add(row['method'])
+    perf = row['perf']
+    ipc = ''
+    if perf.get('cycles') and 'instructions' in perf:
+      ipc = '{:.2f}'.format(perf['instructions'] / perf['cycles'])
+    table_rows.append([row['method'], row['perf_unit']] +
+                      ['{:.4g}'.format(perf[e]) if e in perf else ''
+                       for e in events] + [ipc])
+  if not table_rows:
+    return
+  print(name, 'counters per item:')
+  table = benchutil.Table(
+    ['Benchmark', 'Per'] + events + ['IPC'],
+    [''] * (len(events) + 3),
+    [max(len(row[0]) for row in table_rows), len('iteration')])
+  for row in table_rows:
+    table.print_row(*row)
+  table.print_rulers()
+  print()
+
+
+def print_results(name, rows):
+  methods = []
+  runs = {}
+  for row in rows:
+    if row['method'] not in runs:
+      methods.append(row['method'])
+    runs.setdefault(row['method'], []).append(row)
+  print(name, 'results:')
+  table_rows = []
+  for method in methods:
+    method_runs = runs[method]
+    items = [r['items_per_second'] for r in method_runs
+             if r['items_per_second'] is not None]
+    table_rows.append((
+      method, len(method_runs),
+      benchutil.median([r['time'] for r in method_runs]) * 1e9,
+      benchutil.median([r['cpu_time'] for r in method_runs]) * 1e9,
+      '{:.4g}M'.format(benchutil.median(items) / 1e6) if items else ''))
+  formats = ['', '', '.0f', '.0f', '']
+  table = benchutil.Table(
+    ['Benchmark', 'Runs', 'Time, ns', 'CPU, ns', 'Items/s'], formats,
+    [max(len(benchutil.Table.format_field(f, fmt)) for f in column)
+     for column, fmt in zip(zip(*table_rows), formats)])
+  for row in table_rows:
+    table.print_row(*row)
+  table.print_rulers()
+  print()
+
+
+def selected_binaries():
+  if not options.benchmarks:
+    return binaries
+  names = [name for name, paths in binaries]
+  for name in options.benchmarks:
+    if name not in names:
+      parser.error('unknown benchmark ' + name)
+  return [b for b in binaries if b[0] in options.benchmarks]
+
+
+def run_command():
+  if options.cpus:
+    benchutil.pin_to_cpus([int(cpu) for cpu in options.cpus.split(',')])
+  events = perf_events() if options.perf else None
+  writer = benchutil.ResultsWriter(options.output, 'run-benchmarks')
+  for name, paths in selected_binaries():
+    filename = find_binary(paths)
+    if not filename:
+      print('Skipping', name, 'which is not built')
+      continue
+    print('Running', filename)
+    sys.stdout.flush()
+    rows = make_rows(name, run_benchmark(filename))
+    print_results(name, rows)
+    if events:
+      profile_benchmarks(filename, events, rows)
+      print_perf_results(name, events, rows)
+    writer.write(rows)
+
+
+def parse_sweep_name(name):
+  """Returns the method, value count and digit distribution of an
+  int-benchmark benchmark name such as format_int/values:1000/digits:0"""
+  m = re.match(r'(\w+)/values:(\d+)/digits:(-?\d+)', name)
+  return m.group(1), int(m.group(2)), int(m.group(3))
+
+
+def plot_sweep(filename, lines, caches):
+  plt.figure(figsize=(8, 5))
+  for (method, digits, threads), points in sorted(lines.items()):
+    x, y = zip(*sorted(points))
+    label = '{} (digits {})'.format(method, digits)
+    if threads > 1:
+      label += ' x{}'.format(threads)
+    plt.plot(x, [ips / 1e6 for ips in y], marker='o', label=label)
+  for cache in caches:
+    if cache.get('type') in ('Data', 'Unified'):
+      plt.axvline(cache['size'], ls='--', color='grey')
+      plt.annotate('L{}'.format(cache['level']), (cache['size'], 1),
+                   xycoords=('data', 'axes fraction'), va='top')
+  plt.xscale('log')
+  plt.xlabel('working set (bytes)')
+  plt.ylabel('throughput (M items/s)')
+  plt.grid(color='k', alpha=0.4, ls=':')
+  plt.legend(fontsize=9)
+  plt.savefig(filename, bbox_inches='tight')
+
+
+def sweep_command():
+  if options.cpus:
+    benchutil.pin_to_cpus([int(cpu) for cpu in options.cpus.split(',')])
+  filename = find_binary(['int-benchmark'])
+  if not filename:
+    parser_sweep.error('int-benchmark not found in ' + options.build_dir)
+  env = dict(os.environ, INT_BENCHMARK_SIZES=options.sizes,
+             INT_BENCHMARK_DIGITS=options.digits)
+  print('Running', filename)
+  sys.stdout.flush()
+  report = run_benchmark(filename, env=env)
+  rows = make_rows('int-benchmark', report)
+  runs = {}
+  for row in rows:
+    method, size, digits = parse_sweep_name(row['method'])
+    row.update(method=method, args=[size, digits],
+               working_set=row['counters'].get('working_set'))
+    runs.setdefault((method, digits, row['threads'], size), []).append(row)
+
+  table = benchutil.Table(
+    ['Method', 'Digits', 'Threads', 'Values', 'Working set, KiB', 'Items/s'],
+    ['', '', '', '', '.0f', ''], [max(len(key[0]) for key in runs)])
+  lines = {}
+  for (method, digits, threads, size), method_runs in sorted(runs.items()):
+    ips = benchutil.median([r['items_per_second'] for r in method_runs])
+    working_set = method_runs[0]['working_set']
+    table.print_row(method, digits, threads, size, working_set / 1024,
+                    '{:.4g}M'.format(ips / 1e6))
+    lines.setdefault((method, digits, threads), []).append((working_set, ips))
+  table.print_rulers()
+
+  benchutil.ResultsWriter(options.output, 'run-benchmarks').write(rows)
+  if options.plot:
+    plot_sweep(options.plot, lines, report.get('context', {}).get('caches', []))
+
+
+def scaling_efficiency(rows):
+  """Returns a list of (benchmark, threads, items per second, efficiency)
+  tuples where efficiency is the throughput on n threads divided by n times
+  the throughput on one thread"""
+  runs = {}
+  names = []
+  for row in rows:
+    if not row['items_per_second']:
+      continue
+    name = re.sub(r'/threads:\d+$', '', row['method'])
+    name = re.sub(r'/real_time$', '', name)
+    if name not in runs:
+      names.append(name)
+    runs.setdefault(name, {}).setdefault(row['threads'], []).append(
+      row['items_per_second'])
+  result = []
+  for name in names:
+    ips = {threads: benchutil.median(values)
+           for threads, values in runs[name].items()}
+    if 1 not in ips:
+      continue
+    for threads in sorted(ips):
+      result.append((name, threads, ips[threads],
+                     ips[threads] / (threads * ips[1])))
+  return result
+
+
+def plot_scaling(filename, efficiency):
+  plt.figure(figsize=(8, 5))
+  lines = {}
+  for name, threads, ips, e in efficiency:
+    lines.setdefault(name, []).append((threads, e))
+  for name, points in sorted(lines.items()):
+    x, y = zip(*points)
+    plt.plot(x, y, marker='o', label=name)
+  plt.xscale('log', base=2)
+  plt.ylim(0, 1.1)
+  plt.xlabel('threads')
+  plt.ylabel('scaling efficiency')
+  plt.grid(color='k', alpha=0.4, ls=':')
+  plt.legend(fontsize=9)
+  plt.savefig(filename, bbox_inches='tight')
+
+
+def scaling_command():
+  writer = benchutil.ResultsWriter(options.output, 'run-benchmarks')
+  efficiency = []
+  for name, paths in selected_binaries():
+    filename = find_binary(paths)
+    if not filename:
+      print('Skipping', name, 'which is not built')
+      continue
+    print('Running', filename)
+    sys.stdout.flush()
+    rows = make_rows(name, run_benchmark(filename))
+    writer.write(rows)
+    results = scaling_efficiency(rows)
+    if not results:
+      continue
+    print(name, 'scaling:')
+    table = benchutil.Table(
+      ['Benchmark', 'Threads', 'Items/s', 'Efficiency'], ['', '', '', '.2f'],
+      [max(len(r[0]) for r in results)])
+    for benchmark, threads, ips, e in results:
+      table.print_row(benchmark, threads, '{:.4g}M'.format(ips / 1e6), e)
+    table.print_rulers()
+    print()
+    efficiency += [('{} {}'.format(name, r[0]),) + r[1:] for r in results]
+  if options.plot and efficiency:
+    plot_scaling(options.plot, efficiency)
+
+
+commands = {
+  'run': run_command,
+  'sweep': sweep_command,
+  'scaling': scaling_command,
+}
+
+if __name__ == '__main__':
+  if not options.command:
+    parser.error('no command specified')
+  commands[options.command]()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Script to measure the speed of formatting with tinyformat_speed_test.
+# Each method is run repeatedly and the time of a run without formatting,
+# which consists of process startup and dynamic loading, is subtracted.
+
+from __future__ import print_function, division
+
+import argparse
+import os
+import sys
+from subprocess import CalledProcessError
+
+import benchutil
+
+methods = ['printf', 'iostreams', 'format', 'fmt::compile', 'tinyformat',
+           'boost', 'folly', 'stb_sprintf']
+
+parser = argparse.ArgumentParser()
+parser.add_argument('methods', type=str, nargs='*',
+                    help='methods to test, all by default')
+parser.add_argument('--build-dir', type=str, default='.',
+                    help='directory containing tinyformat_speed_test')
+benchutil.add_sampling_arguments(parser, runs=5)
+parser.add_argument('--output', type=str,
+                    default=benchutil.DEFAULT_RESULTS_FILENAME,
+                    help='results file to append to')
+options = parser.parse_args(sys.argv[1:])
+
+
+def measure(command):
+  """Runs command repeatedly discarding its output and returns the runs and
+  the summary of their wall times"""
+  with open(os.devnull, 'w') as devnull:
+    return benchutil.sample(
+      lambda: benchutil.run(command, stdout=devnull, stderr=devnull),
+      lambda r: r['wall_time'], options)
+
+
+def median_of(runs, key):
+  return benchutil.median([r[key] for r in runs])
+
+
+def speed_test():
+  program = os.path.join(options.build_dir, 'tinyformat_speed_test')
+  if not os.path.exists(program):
+    parser.error(program + ' not found')
+  for method in options.methods:
+    if method not in methods:
+      parser.error('unknown method ' + method)
+
+  # tinyformat_speed_test exits immediately when no method is given.
+  print('Measuring startup time')
+  sys.stdout.flush()
+  baseline_runs, baseline = measure([program])
+  startup = {key: median_of(baseline_runs, key)
+             for key in ('wall_time', 'user_time', 'sys_time')}
+
+  writer = benchutil.ResultsWriter(options.output, 'speed-test')
+  table = benchutil.Table(
+    ['Method', 'Time, s', 'MAD, s', 'User, s', 'Sys, s', 'Max RSS, MiB',
+     'Voluntary CS', 'Involuntary CS'],
+    ['', '.3f', '.3f', '.3f', '.3f', '.1f', '.0f', '.0f'], [12])
+  table.print_row('(startup)', startup['wall_time'], baseline['mad'],
+                  startup['user_time'], startup['sys_time'],
+                  median_of(baseline_runs, 'max_rss') / 1024.0,
+                  median_of(baseline_runs, 'voluntary_context_switches'),
+                  median_of(baseline_runs, 'involuntary_context_switches'))
+  unavailable = []
+  for method in options.methods or methods:
+    # Methods that were not built in, such as folly, fail immediately and
+    # would otherwise be reported with a time close to zero.
+    try:
+      runs, summary = measure([program, method])
+    except CalledProcessError:
+      unavailable.append(method)
+      continue
+    table.print_row(method, summary['median'] - startup['wall_time'],
+                    summary['mad'],
+                    median_of(runs, 'user_time') - startup['user_time'],
+                    median_of(runs, 'sys_time') - startup['sys_time'],
+                    median_of(runs, 'max_rss') / 1024.0,
+                    median_of(runs, 'voluntary_context_switches'),
+                    median_of(runs, 'involuntary_context_switches'))
+    sys.stdout.flush()
+    writer.write(
+      {'method': method, 'config': 'speed-test', 'args': None, 'run': i,
+       'time': r['wall_time'], 'startup_time': startup['wall_time'],
+       'user_time': r['user_time'], 'sys_time': r['sys_time'],
+       'max_rss': r['max_rss'],
+       'voluntary_context_switches': r['voluntary_context_switches'],
+       'involuntary_context_switches': r['involuntary_context_switches']}
+      for i, r in enumerate(runs))
+  table.print_rulers()
+  print('Times exclude the startup time shown in the first row.')
+  if unavailable:
+    print('Failed or not available:', ', '.join(unavailable))
+
+
+if __name__ == '__main__':
+  speed_test()
@@ -0,0 +1,158 @@
+// Allocation counting by interposing malloc and friends
+//
+// The functions defined here take precedence over the C library ones and
+// forward to them after counting. The C library functions are looked up with
+// dlsym(RTLD_NEXT) on first use.
+
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+
+#include "alloc-counter.h"
+
+#include <atomic>
+#include <cstdlib>
+#include <cstring>
+
+#ifdef __GLIBC__
+#include <dlfcn.h>
+#include <malloc.h>
+
+namespace {
+
+using malloc_fn = void* (*)(std::size_t);
+using calloc_fn = void* (*)(std::size_t, std::size_t);
+using realloc_fn = void* (*)(void*, std::size_t);
+using free_fn = void (*)(void*);
+using memalign_fn = void* (*)(std::size_t, std::size_t);
+using posix_memalign_fn = int (*)(void**, std::size_t, std::size_t);
+
+malloc_fn next_malloc;
+calloc_fn next_calloc;
+realloc_fn next_realloc;
+free_fn next_free;
+memalign_fn next_aligned_alloc;
+posix_memalign_fn next_posix_memalign;
+
+// dlsym may allocate memory while the C library functions are being looked
+// up. Such allocations come from this buffer and are never freed.
+alignas(16) char bootstrap_buffer[4096];
+std::size_t bootstrap_size;
+bool resolving;
+
+void* bootstrap_alloc(std::size_t size) {
+  size = (size + 15) & ~std::size_t(15);
+  if (size > sizeof(bootstrap_buffer) - bootstrap_size) std::abort();
+  void* p = bootstrap_buffer + bootstrap_size;
+  bootstrap_size += size;
+  return p;
+}
+
+bool is_bootstrap(void* p) {
+  auto c = static_cast<char*>(p);
+  return c >= bootstrap_buffer && c < bootstrap_buffer + sizeof(bootstrap_buffer);
+}
+
+template <typename F> void resolve(F& f, const char* name) {
+  f = reinterpret_cast<F>(dlsym(RTLD_NEXT, name));
+  if (!f) std::abort();
+}
+
+void resolve_all() {
+  resolving = true;
+  resolve(next_malloc, "malloc");
+  resolve(next_calloc, "calloc");
+  resolve(next_realloc, "realloc");
+  resolve(next_free, "free");
+  resolve(next_aligned_alloc, "aligned_alloc");
+  resolve(next_posix_memalign, "posix_memalign");
+  resolving = false;
+}
+
+// -1 until COUNT_ALLOCS has been checked. Threads that check it concurrently
+// store the same value.
+std::atomic<int> enabled{-1};
+
+thread_local alloc_counts counts;
+
+void count(std::size_t size) {
+  if (!alloc_counter_enabled()) return;
+  ++counts.allocs;
+  counts.bytes += size;
+}
+
+}  // namespace
+
+bool alloc_counter_enabled() {
+  int value = enabled.load(std::memory_order_relaxed);
+  if (value < 0) {
+    const char* env = std::getenv("COUNT_ALLOCS");
+    value = env && *env && std::strcmp(env, "0") != 0;
+    enabled.store(value, std::memory_order_relaxed);
+  }
+  return value != 0;
+}
+
+alloc_counts thread_alloc_counts() { return counts; }
+
+extern "C" {
+
+void* malloc(std::size_t size) noexcept {
+  if (!next_malloc) {
+    if (resolving) return bootstrap_alloc(size);
+    resolve_all();
+  }
+  count(size);
+  return next_malloc(size);
+}
+
+void* calloc(std::size_t n, std::size_t size) noexcept {
+  if (!next_calloc) {
+    // The bootstrap buffer is zero-initialized.
+    if (resolving) return bootstrap_alloc(n * size);
+    resolve_all();
+  }
+  count(n * size);
+  return next_calloc(n, size);
+}
+
+void* realloc(void* p, std::size_t size) noexcept {
+  if (is_bootstrap(p)) {
+    void* result = malloc(size);
+    std::size_t available = bootstrap_buffer + sizeof(bootstrap_buffer) -
+                            static_cast<char*>(p);
+    if (result) std::memcpy(result, p, size < available ? size : available);
+    return result;
+  }
+  if (!next_realloc) resolve_all();
+  count(size);
+  return next_realloc(p, size);
+}
+
+void free(void* p) noexcept {
+  if (!p || is_bootstrap(p)) return;
+  if (!next_free) resolve_all();
+  next_free(p);
+}
+
+void* aligned_alloc(std::size_t alignment, std::size_t size) noexcept {
+  if (!next_aligned_alloc) resolve_all();
+  count(size);
+  return next_aligned_alloc(alignment, size);
+}
+
+int posix_memalign(void** p, std::size_t alignment, std::size_t size) noexcept {
+  if (!next_posix_memalign) resolve_all();
+  count(size);
+  return next_posix_memalign(p, alignment, size);
+}
+
+}  // extern "C"
+
+#else
+
+bool alloc_counter_enabled() { return false; }
+
+alloc_counts thread_alloc_counts() { return {}; }
+
+#endif
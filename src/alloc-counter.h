@@ -0,0 +1,54 @@
+// Allocation counting for benchmarks
+//
+// alloc-counter.cc interposes malloc, calloc, realloc and free and counts
+// allocations per thread when the COUNT_ALLOCS environment variable is set to
+// a value other than 0. Counting is only supported with glibc.
+
+#ifndef ALLOC_COUNTER_H_
+#define ALLOC_COUNTER_H_
+
+#include <cstddef>
+
+#include <benchmark/benchmark.h>
+
+struct alloc_counts {
+  std::size_t allocs;
+  std::size_t bytes;
+};
+
+// Returns true if allocations are counted.
+bool alloc_counter_enabled();
+
+// Returns the number and total size of allocations made by the current
+// thread.
+alloc_counts thread_alloc_counts();
+
+// Counts allocations made by the current thread since construction.
+class alloc_scope {
+ private:
+  alloc_counts start_;
+
+ public:
+  alloc_scope() : start_(thread_alloc_counts()) {}
+
+  alloc_counts counts() const {
+    auto counts = thread_alloc_counts();
+    return {counts.allocs - start_.allocs, counts.bytes - start_.bytes};
+  }
+};
+
+// Sets the allocs_per_item and bytes_per_item counters from the allocations
+// in scope if allocations are counted.
+inline void set_alloc_counters(benchmark::State& state,
+                               const alloc_scope& scope, std::size_t items) {
+  if (!alloc_counter_enabled() || items == 0) return;
+  auto counts = scope.counts();
+  state.counters["allocs_per_item"] = benchmark::Counter(
+      static_cast<double>(counts.allocs) / items,
+      benchmark::Counter::kAvgThreads);
+  state.counters["bytes_per_item"] = benchmark::Counter(
+      static_cast<double>(counts.bytes) / items,
+      benchmark::Counter::kAvgThreads);
+}
+
+#endif  // ALLOC_COUNTER_H_
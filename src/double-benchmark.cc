@@ -2,54 +2,206 @@
 
 #include "dtoa_milo.h"
 #include <benchmark/benchmark.h>
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
 #include <cstdio>
+#include <cstdlib>
 #include <fmt/format.h>
 #include <random>
+#include <thread>
 #include <vector>
 
-std::vector<double> generate_random_data() {
+// Value distributions selected by the distribution benchmark argument.
+enum distribution {
+  uniform_bits,    // Random bit patterns excluding infinities and NaNs.
+  small_integers,  // Integers in [-1'000'000, 1'000'000].
+  prices,          // Prices with 2 decimal places up to 100'000.
+  subnormals,      // Subnormal numbers.
+  huge_exponents,  // Numbers with decimal exponents above 277 or below -277.
+  num_distributions
+};
+
+const char *distribution_names[] = {"uniform_bits", "small_integers", "prices",
+                                    "subnormals", "huge_exponents"};
+
+double random_double(std::mt19937_64 &gen, distribution d) {
+  const uint64_t sign_and_mantissa =
+      (uint64_t(1) << 63) | ((uint64_t(1) << 52) - 1);
+  switch (d) {
+  case small_integers:
+    return std::uniform_int_distribution<int>(-1'000'000, 1'000'000)(gen);
+  case prices:
+    return std::uniform_int_distribution<int>(0, 10'000'000)(gen) / 100.0;
+  case subnormals:
+    return fmt::internal::bit_cast<double>(gen() & sign_and_mantissa);
+  case huge_exponents: {
+    // Biased binary exponents within 100 of the minimum or the maximum.
+    uint64_t exp = gen() % 100;
+    exp = gen() % 2 ? 2046 - exp : 1 + exp;
+    return fmt::internal::bit_cast<double>((gen() & sign_and_mantissa) |
+                                           exp << 52);
+  }
+  default:
+    return fmt::internal::bit_cast<double>(gen());
+  }
+}
+
+std::vector<double> generate_random_data(distribution d) {
   auto data = std::vector<double>();
   auto gen = std::mt19937_64();
-  for (auto i = 0; i < 1000; ++i) {
-    auto d = fmt::internal::bit_cast<double>(gen());
-    data.push_back(d);
-    fmt::print("{}\n", d);
+  while (data.size() < 1000) {
+    auto value = random_double(gen, d);
+    // Infinities and NaNs don't round trip and dtoa_milo doesn't support them.
+    // Zero is not a subnormal.
+    if (std::isfinite(value) && (d != subnormals || value != 0))
+      data.push_back(value);
   }
   return data;
 }
 
-auto data = generate_random_data();
+const std::vector<double> &get_data(const benchmark::State &state) {
+  static const auto data = [] {
+    std::vector<std::vector<double>> result;
+    for (int d = 0; d < num_distributions; ++d)
+      result.push_back(generate_random_data(static_cast<distribution>(d)));
+    return result;
+  }();
+  return data[state.range(0)];
+}
 
-void sprintf(benchmark::State &state) {
-  char buf[100];
-  while (state.KeepRunning()) {
-    for (auto n : data) {
-      // Set precision to 17 to satisfy roundtrip guarantees.
-      std::sprintf(buf, "%.17g", n);
-    }
+// Runs a benchmark on 1, 2, 4, ... threads up to the number of hardware
+// threads. Real time is used so that items_per_second gives the total
+// throughput of all threads.
+void thread_range(benchmark::internal::Benchmark *b) {
+  b->ThreadRange(1, std::max(1u, std::thread::hardware_concurrency()))
+      ->UseRealTime();
+}
+
+// Runs a benchmark on every distribution.
+void distributions(benchmark::internal::Benchmark *b) {
+  b->ArgNames({"distribution"});
+  for (int d = 0; d < num_distributions; ++d)
+    b->Arg(d);
+}
+
+// Runs a benchmark on every distribution with several precisions.
+void precisions(benchmark::internal::Benchmark *b) {
+  b->ArgNames({"distribution", "precision"});
+  for (int d = 0; d < num_distributions; ++d) {
+    for (int precision : {0, 2, 6, 10, 17})
+      b->Args({d, precision});
   }
 }
 
-BENCHMARK(sprintf);
+// Large enough for 1.7976931348623157e308 in fixed notation.
+constexpr int buffer_size = 512;
 
-void format_to(benchmark::State &state) {
-  char buf[100];
+// Checks that format gives correct output for all values. Without a
+// precision, i.e. for the shortest round-trip output, parsing the output
+// with strtod must give the original value. Otherwise it must give the same
+// value as the output of sprintf with the reference format ref_format.
+template <typename Format>
+bool verify(benchmark::State &state, const std::vector<double> &data,
+            Format format, const char *ref_format = nullptr) {
+  char buf[buffer_size], ref_buf[buffer_size];
+  int precision = ref_format ? state.range(1) : 0;
+  for (auto n : data) {
+    format(buf, n, precision);
+    double expected = n;
+    if (ref_format) {
+      std::snprintf(ref_buf, sizeof(ref_buf), ref_format, precision, n);
+      expected = std::strtod(ref_buf, nullptr);
+    }
+    if (std::strtod(buf, nullptr) != expected) {
+      fmt::print(stderr, "{} {}: {:.17g} formatted as {}\n",
+                 distribution_names[state.range(0)], precision, n, buf);
+      state.SkipWithError("round-trip check failed");
+      return false;
+    }
+  }
+  return true;
+}
+
+// Measures format which writes a null-terminated representation of a double
+// with the given precision into a buffer of buffer_size chars.
+template <typename Format>
+void run(benchmark::State &state, Format format,
+         const char *ref_format = nullptr) {
+  const auto &data = get_data(state);
+  state.SetLabel(distribution_names[state.range(0)]);
+  if (!verify(state, data, format, ref_format))
+    return;
+  int precision = ref_format ? state.range(1) : 0;
+  char buf[buffer_size];
   while (state.KeepRunning()) {
     for (auto n : data)
-      fmt::format_to(buf, "{}", n);
+      format(buf, n, precision);
   }
+  state.SetItemsProcessed(state.iterations() * data.size());
+}
+
+void sprintf(benchmark::State &state) {
+  run(state, [](char *buf, double n, int) {
+    // Set precision to 17 to satisfy roundtrip guarantees.
+    std::sprintf(buf, "%.17g", n);
+  });
+}
+
+BENCHMARK(sprintf)->Apply(distributions)->Apply(thread_range);
+
+void format_to(benchmark::State &state) {
+  run(state, [](char *buf, double n, int) {
+    *fmt::format_to(buf, "{}", n) = '\0';
+  });
 }
 
-BENCHMARK(format_to);
+BENCHMARK(format_to)->Apply(distributions)->Apply(thread_range);
 
 void dtoa_milo(benchmark::State &state) {
-  char buf[100];
-  while (state.KeepRunning()) {
-    for (auto n : data)
-      dtoa_milo(n, buf);
-  }
+  run(state, [](char *buf, double n, int) { dtoa_milo(n, buf); });
+}
+
+BENCHMARK(dtoa_milo)->Apply(distributions)->Apply(thread_range);
+
+void sprintf_fixed(benchmark::State &state) {
+  run(state,
+      [](char *buf, double n, int precision) {
+        std::sprintf(buf, "%.*f", precision, n);
+      },
+      "%.*f");
+}
+
+BENCHMARK(sprintf_fixed)->Apply(precisions)->Apply(thread_range);
+
+void format_to_fixed(benchmark::State &state) {
+  run(state,
+      [](char *buf, double n, int precision) {
+        *fmt::format_to(buf, "{:.{}f}", n, precision) = '\0';
+      },
+      "%.*f");
+}
+
+BENCHMARK(format_to_fixed)->Apply(precisions)->Apply(thread_range);
+
+void sprintf_exp(benchmark::State &state) {
+  run(state,
+      [](char *buf, double n, int precision) {
+        std::sprintf(buf, "%.*e", precision, n);
+      },
+      "%.*e");
+}
+
+BENCHMARK(sprintf_exp)->Apply(precisions)->Apply(thread_range);
+
+void format_to_exp(benchmark::State &state) {
+  run(state,
+      [](char *buf, double n, int precision) {
+        *fmt::format_to(buf, "{:.{}e}", n, precision) = '\0';
+      },
+      "%.*e");
 }
 
-BENCHMARK(dtoa_milo);
+BENCHMARK(format_to_exp)->Apply(precisions)->Apply(thread_range);
 
 BENCHMARK_MAIN();
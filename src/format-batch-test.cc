@@ -0,0 +1,53 @@
+#include "format-batch.h"
+#include <gmock/gmock.h>
+
+#include <climits>
+#include <string>
+#include <vector>
+
+std::string join(const std::vector<int>& values, char delimiter) {
+  std::string result;
+  for (auto value : values) {
+    if (!result.empty()) result += delimiter;
+    result += std::to_string(value);
+  }
+  return result;
+}
+
+std::string format(const std::vector<int>& values, char delimiter = ',') {
+  std::vector<char> buffer(format_batch_size(values.size()));
+  char* end = format_batch(values.data(), values.size(), buffer.data(),
+                           buffer.size(), delimiter);
+  return std::string(buffer.data(), end);
+}
+
+TEST(FormatBatchTest, Empty) {
+  EXPECT_EQ("", format({}));
+}
+
+TEST(FormatBatchTest, Limits) {
+  std::vector<int> values = {0, -1, 1, INT_MIN, INT_MAX, INT_MIN + 1};
+  EXPECT_EQ(join(values, ','), format(values));
+  EXPECT_EQ(join(values, '\t'), format(values, '\t'));
+}
+
+TEST(FormatBatchTest, DigitCounts) {
+  std::vector<int> values;
+  for (int n = 1; n <= INT_MAX / 10; n *= 10) {
+    for (int value : {n - 1, n, n * 10 - 1, -n, -(n * 10 - 1)})
+      values.push_back(value);
+  }
+  EXPECT_EQ(join(values, ','), format(values));
+}
+
+TEST(FormatBatchTest, Capacity) {
+  int values[] = {1, 2, 3};
+  char buffer[format_batch_size(3)];
+  EXPECT_EQ(nullptr, format_batch(values, 3, buffer, sizeof(buffer) - 1));
+  EXPECT_EQ(buffer + 5, format_batch(values, 3, buffer, sizeof(buffer)));
+}
+
+int main(int argc, char **argv) {
+  ::testing::InitGoogleTest(&argc, argv);
+  return RUN_ALL_TESTS();
+}
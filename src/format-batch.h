@@ -0,0 +1,82 @@
+// Batched decimal integer formatting
+//
+// Formats an array of integers into one contiguous, delimiter-separated
+// buffer with a single call and a single buffer size check.
+
+#ifndef FORMAT_BATCH_H_
+#define FORMAT_BATCH_H_
+
+#include <cstddef>
+#include <cstdint>
+
+// Returns the maximum number of chars written by format_batch for size values:
+// up to 11 chars for each value ("-2147483648") and a delimiter between them.
+constexpr std::size_t format_batch_size(std::size_t size) {
+  return size * 12;
+}
+
+namespace format_batch_internal {
+
+inline int count_digits(std::uint32_t n) {
+  static const std::uint32_t powers_of_10[] = {
+      0, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000,
+      1000000000};
+  int t = (32 - __builtin_clz(n | 1)) * 1233 >> 12;
+  return t - (n < powers_of_10[t]) + 1;
+}
+
+// Writes value to out and returns a pointer past the end of the output.
+inline char* format_value(int value, char* out) {
+  static const char digits[] =
+      "0001020304050607080910111213141516171819"
+      "2021222324252627282930313233343536373839"
+      "4041424344454647484950515253545556575859"
+      "6061626364656667686970717273747576777879"
+      "8081828384858687888990919293949596979899";
+  auto n = static_cast<std::uint32_t>(value);
+  if (value < 0) {
+    *out++ = '-';
+    n = 0 - n;
+  }
+  char* end = out + count_digits(n);
+  char* p = end;
+  while (n >= 100) {
+    auto index = (n % 100) * 2;
+    n /= 100;
+    *--p = digits[index + 1];
+    *--p = digits[index];
+  }
+  if (n < 10) {
+    *--p = static_cast<char>('0' + n);
+  } else {
+    *--p = digits[n * 2 + 1];
+    *--p = digits[n * 2];
+  }
+  return end;
+}
+
+}  // namespace format_batch_internal
+
+// Formats size values separated by delimiter into out which must have room
+// for format_batch_size(size) chars. Returns a pointer past the end of the
+// output which is not null-terminated.
+inline char* format_batch(const int* values, std::size_t size, char* out,
+                          char delimiter = ',') {
+  if (size == 0) return out;
+  out = format_batch_internal::format_value(values[0], out);
+  for (std::size_t i = 1; i < size; ++i) {
+    *out++ = delimiter;
+    out = format_batch_internal::format_value(values[i], out);
+  }
+  return out;
+}
+
+// Same as above but checks that the output of capacity chars has room for
+// format_batch_size(size) chars and returns nullptr if it doesn't.
+inline char* format_batch(const int* values, std::size_t size, char* out,
+                          std::size_t capacity, char delimiter = ',') {
+  if (capacity < format_batch_size(size)) return nullptr;
+  return format_batch(values, size, out, delimiter);
+}
+
+#endif  // FORMAT_BATCH_H_
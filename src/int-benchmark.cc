@@ -7,9 +7,15 @@
 #include <cstdio>
 #include <cstdlib>
 #include <limits>
+#include <map>
+#include <memory>
+#include <mutex>
 #include <numeric>
+#include <random>
 #include <sstream>
 #include <string>
+#include <thread>
+#include <utility>
 #include <vector>
 
 #include <benchmark/benchmark.h>
@@ -17,6 +23,8 @@
 #include <boost/format.hpp>
 #include <boost/lexical_cast.hpp>
 #include <boost/spirit/include/karma.hpp>
+#include "alloc-counter.h"
+#include "format-batch.h"
 #include "itostr.cc"
 
 // Integer to string converter by Alf P. Steinbach modified to return a pointer
@@ -83,6 +91,13 @@ char* ltoa(long N, char* str, int base) {
   return str;
 }
 
+// Digit distributions of the generated values. Other values of the digits
+// argument between 1 and 10 give values with exactly that many digits.
+enum {
+  uniform_digits = -1,  // The number of digits is uniformly distributed.
+  karma_digits = 0      // Distribution from the Boost Karma benchmark.
+};
+
 struct Data {
   std::vector<int> values;
   size_t total_length;
@@ -105,19 +120,37 @@ struct Data {
     int counts[11] = {};
     for (auto value : values)
       ++counts[fmt::format_int(value).size()];
-    fmt::print("The number of values by digit count:\n");
+    fmt::print(stderr, "The number of values by digit count:\n");
     for (int i = 1; i < 11; ++i)
-      fmt::print("{:2} {:6}\n", i, counts[i]);
+      fmt::print(stderr, "{:2} {:6}\n", i, counts[i]);
+  }
+
+  // Returns a random value with the given number of digits.
+  static int random_value(std::mt19937& gen, int num_digits) {
+    int min = 1;
+    for (int i = 1; i < num_digits; ++i) min *= 10;
+    int max = num_digits < 10 ? min * 10 - 1 : std::numeric_limits<int>::max();
+    if (num_digits == 1) min = 0;
+    return std::uniform_int_distribution<int>(min, max)(gen);
   }
 
-  Data() : values(1'000'000) {
-    // Same data as in Boost Karma int generator test:
-    // https://www.boost.org/doc/libs/1_63_0/libs/spirit/workbench/karma/int_generator.cpp
-    std::srand(0);
-    std::generate(values.begin(), values.end(), []() {
-      int scale = std::rand() / 100 + 1;
-      return (std::rand() * std::rand()) / scale;
-    });
+  Data(size_t size, int digits) : values(size) {
+    if (digits == karma_digits) {
+      // Same data as in Boost Karma int generator test:
+      // https://www.boost.org/doc/libs/1_63_0/libs/spirit/workbench/karma/int_generator.cpp
+      std::srand(0);
+      std::generate(values.begin(), values.end(), []() {
+        int scale = std::rand() / 100 + 1;
+        return (std::rand() * std::rand()) / scale;
+      });
+    } else {
+      std::mt19937 gen(0);
+      std::uniform_int_distribution<int> num_digits(1, 10);
+      std::generate(values.begin(), values.end(), [&]() {
+        return random_value(gen, digits == uniform_digits ? num_digits(gen)
+                                                          : digits);
+      });
+    }
     total_length =
         std::accumulate(begin(), end(), size_t(), [](size_t lhs, int rhs) {
           char buffer[12];
@@ -125,16 +158,83 @@ struct Data {
         });
     print_digit_counts();
   }
-} data;
+};
+
+// Returns the data for the value count and digit distribution given by the
+// benchmark arguments. Data is generated once and shared by all benchmarks.
+const Data& get_data(const benchmark::State& state) {
+  static std::mutex mutex;
+  static std::map<std::pair<size_t, int>, std::unique_ptr<Data>> cache;
+  std::lock_guard<std::mutex> lock(mutex);
+  auto& data = cache[{state.range(0), static_cast<int>(state.range(1))}];
+  if (!data) data.reset(new Data(state.range(0), state.range(1)));
+  return *data;
+}
+
+// Returns the comma-separated integers from the environment variable name or
+// default_value if it is not set.
+std::vector<int64_t> env_list(const char* name, int64_t default_value) {
+  const char* s = std::getenv(name);
+  if (!s || !*s) return {default_value};
+  std::vector<int64_t> result;
+  for (;;) {
+    char* end = nullptr;
+    result.push_back(std::strtoll(s, &end, 10));
+    if (end == s || (*end && *end != ',')) {
+      fmt::print(stderr, "invalid {}: {}\n", name, std::getenv(name));
+      std::exit(1);
+    }
+    if (!*end) break;
+    s = end + 1;
+  }
+  return result;
+}
 
-void finalize(benchmark::State& state, size_t result) {
+// Adds the arguments given by the INT_BENCHMARK_SIZES and INT_BENCHMARK_DIGITS
+// environment variables, e.g.
+//   INT_BENCHMARK_SIZES=1000,1000000 INT_BENCHMARK_DIGITS=0,-1,3 int-benchmark
+// By default 1'000'000 values are generated using the Karma distribution.
+void data_args(benchmark::internal::Benchmark* b) {
+  b->ArgNames({"values", "digits"});
+  for (auto size : env_list("INT_BENCHMARK_SIZES", 1'000'000)) {
+    for (auto digits : env_list("INT_BENCHMARK_DIGITS", karma_digits)) {
+      if (size <= 0 || digits < uniform_digits || digits > 10) {
+        fmt::print(stderr, "invalid arguments: {} values, {} digits\n", size,
+                   digits);
+        std::exit(1);
+      }
+      b->Args({size, digits});
+    }
+  }
+}
+
+// Runs a benchmark on 1, 2, 4, ... threads up to the number of hardware
+// threads. Real time is used so that items_per_second gives the total
+// throughput of all threads.
+void thread_range(benchmark::internal::Benchmark* b) {
+  b->ThreadRange(1, std::max(1u, std::thread::hardware_concurrency()))
+      ->UseRealTime();
+}
+
+void finalize(benchmark::State& state, const Data& data, size_t result,
+              const alloc_scope& allocs) {
   if (result != state.iterations() * data.total_length)
     throw std::logic_error("invalid length");
-  state.SetItemsProcessed(state.iterations() * data.values.size());
+  auto items = state.iterations() * data.values.size();
+  state.SetItemsProcessed(items);
+  set_alloc_counters(state, allocs, items);
+  // The output of most methods goes to a small reused buffer so the input
+  // values make up the working set.
+  state.counters["working_set"] =
+      benchmark::Counter(data.values.size() * sizeof(int),
+                         benchmark::Counter::kAvgThreads,
+                         benchmark::Counter::kIs1024);
   benchmark::DoNotOptimize(result);
 }
 
 void sprintf(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -142,11 +242,13 @@ void sprintf(benchmark::State& state) {
       result += std::sprintf(buffer, "%d", value);
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(sprintf);
+BENCHMARK(sprintf)->Apply(data_args)->Apply(thread_range);
 
 void ostringstream(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   std::ostringstream os;
   while (state.KeepRunning()) {
@@ -156,29 +258,35 @@ void ostringstream(benchmark::State& state) {
       result += os.str().size();
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(ostringstream);
+BENCHMARK(ostringstream)->Apply(data_args)->Apply(thread_range);
 
 void to_string(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) result += std::to_string(value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(to_string);
+BENCHMARK(to_string)->Apply(data_args)->Apply(thread_range);
 
 void format(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) result += fmt::format("{}", value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(format);
+BENCHMARK(format)->Apply(data_args)->Apply(thread_range);
 
 void format_to(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -186,11 +294,13 @@ void format_to(benchmark::State& state) {
       result += fmt::format_to(buffer, "{}", value) - buffer;
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(format_to);
+BENCHMARK(format_to)->Apply(data_args)->Apply(thread_range);
 
 void format_to_compile(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -199,40 +309,48 @@ void format_to_compile(benchmark::State& state) {
       result += fmt::format_to(buffer, f, value) - buffer;
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(format_to_compile);
+BENCHMARK(format_to_compile)->Apply(data_args)->Apply(thread_range);
 
 void format_int(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) result += fmt::format_int(value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(format_int);
+BENCHMARK(format_int)->Apply(data_args)->Apply(thread_range);
 
 void lexical_cast(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data)
       result += boost::lexical_cast<std::string>(value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(lexical_cast);
+BENCHMARK(lexical_cast)->Apply(data_args)->Apply(thread_range);
 
 void boost_format(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   boost::format fmt("%d");
   while (state.KeepRunning()) {
     for (auto value : data) result += boost::str(fmt % value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(boost_format);
+BENCHMARK(boost_format)->Apply(data_args)->Apply(thread_range);
 
 void boost_karma_generate(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -242,20 +360,24 @@ void boost_karma_generate(benchmark::State& state) {
       result += ptr - buffer;
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(boost_karma_generate);
+BENCHMARK(boost_karma_generate)->Apply(data_args)->Apply(thread_range);
 
 void voigt_itostr(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) result += itostr(value).size();
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(voigt_itostr);
+BENCHMARK(voigt_itostr)->Apply(data_args)->Apply(thread_range);
 
 void decimal_from(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -264,11 +386,13 @@ void decimal_from(benchmark::State& state) {
     }
   }
   benchmark::DoNotOptimize(result);
-  finalize(state, result);
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(decimal_from);
+BENCHMARK(decimal_from)->Apply(data_args)->Apply(thread_range);
 
 void stout_ltoa(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
   size_t result = 0;
   while (state.KeepRunning()) {
     for (auto value : data) {
@@ -277,8 +401,84 @@ void stout_ltoa(benchmark::State& state) {
       result += strlen(ltoa(value, buffer, 10));
     }
   }
-  finalize(state, result);
+  finalize(state, data, result, allocs);
+}
+BENCHMARK(stout_ltoa)->Apply(data_args)->Apply(thread_range);
+
+// Benchmarks formatting all values into one contiguous comma-separated
+// buffer. The per-value loops call a formatting function for each value and
+// write a delimiter after it while format_batch formats all of them in a
+// single call.
+
+// Adds the length of the joined output excluding delimiters to result.
+void add_joined_length(size_t& result, const Data& data, size_t length) {
+  result += length - (data.values.size() - 1);
+}
+
+void format_to_joined(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
+  size_t result = 0;
+  fmt::memory_buffer buf;
+  while (state.KeepRunning()) {
+    buf.clear();
+    for (auto value : data) {
+      fmt::format_to(std::back_inserter(buf), "{}", value);
+      buf.push_back(',');
+    }
+    add_joined_length(result, data, buf.size() - 1);
+  }
+  finalize(state, data, result, allocs);
+}
+BENCHMARK(format_to_joined)->Apply(data_args)->Apply(thread_range);
+
+void format_int_joined(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
+  size_t result = 0;
+  std::vector<char> buf(format_batch_size(data.values.size()));
+  while (state.KeepRunning()) {
+    char* out = buf.data();
+    for (auto value : data) {
+      auto f = fmt::format_int(value);
+      out = std::copy(f.data(), f.data() + f.size(), out);
+      *out++ = ',';
+    }
+    add_joined_length(result, data, out - buf.data() - 1);
+  }
+  finalize(state, data, result, allocs);
+}
+BENCHMARK(format_int_joined)->Apply(data_args)->Apply(thread_range);
+
+void decimal_from_joined(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
+  size_t result = 0;
+  std::vector<char> buf(format_batch_size(data.values.size()));
+  while (state.KeepRunning()) {
+    char* out = buf.data();
+    for (auto value : data) {
+      out = cppx::decimal_from(value, out);
+      *out++ = ',';
+    }
+    add_joined_length(result, data, out - buf.data() - 1);
+  }
+  finalize(state, data, result, allocs);
+}
+BENCHMARK(decimal_from_joined)->Apply(data_args)->Apply(thread_range);
+
+void format_batch_joined(benchmark::State& state) {
+  const Data& data = get_data(state);
+  alloc_scope allocs;
+  size_t result = 0;
+  std::vector<char> buf(format_batch_size(data.values.size()));
+  while (state.KeepRunning()) {
+    char* end = format_batch(data.values.data(), data.values.size(),
+                             buf.data(), buf.size());
+    add_joined_length(result, data, end - buf.data());
+  }
+  finalize(state, data, result, allocs);
 }
-BENCHMARK(stout_ltoa);
+BENCHMARK(format_batch_joined)->Apply(data_args)->Apply(thread_range);
 
 BENCHMARK_MAIN();
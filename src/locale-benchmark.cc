@@ -2,27 +2,47 @@
 //
 // Copyright (c) 2019 - present, Victor Zverovich
 // All rights reserved.
+//
+// Benchmarks are registered for each locale installed on the machine as
+// listed by `locale -a` or given as a comma-separated list in the
+// LOCALE_BENCHMARK_LOCALES environment variable, and for several grouping
+// styles.
 
 #include <algorithm>
 #include <cstdio>
 #include <cstdlib>
+#include <functional>
 #include <limits>
+#include <map>
+#include <mutex>
 #include <numeric>
+#include <shared_mutex>
 #include <sstream>
+#include <stdexcept>
 #include <string>
+#include <thread>
 #include <vector>
 
 #include <benchmark/benchmark.h>
 #include <fmt/locale.h>
+#include "alloc-counter.h"
+
+struct grouping_numpunct : std::numpunct<char> {
+  std::string grouping;
+
+  explicit grouping_numpunct(std::string g) : grouping(std::move(g)) {}
 
-struct separate_thousands : std::numpunct<char> {
   char do_thousands_sep() const { return ','; }
-  std::string do_grouping() const { return "\3"; }
+  std::string do_grouping() const { return grouping; }
+};
+
+struct Locale {
+  std::string name;
+  std::function<std::locale()> make;
 };
 
 struct Data {
   std::vector<int> values;
-  size_t total_length;
 
   auto begin() const { return values.begin(); }
   auto end() const { return values.end(); }
@@ -42,9 +62,9 @@ struct Data {
     int counts[11] = {};
     for (auto value : values)
       ++counts[fmt::format_int(value).size()];
-    fmt::print("The number of values by digit count:\n");
+    fmt::print(stderr, "The number of values by digit count:\n");
     for (int i = 1; i < 11; ++i)
-      fmt::print("{:2} {:6}\n", i, counts[i]);
+      fmt::print(stderr, "{:2} {:6}\n", i, counts[i]);
   }
 
   Data() : values(1'000'000) {
@@ -55,32 +75,86 @@ struct Data {
       int scale = std::rand() / 100 + 1;
       return (std::rand() * std::rand()) / scale;
     });
-    std::ostringstream os;
-    os.imbue(std::locale(std::locale(), new separate_thousands()));
-    total_length =
-        std::accumulate(begin(), end(), size_t(), [&](size_t lhs, int rhs) {
-          os.str(std::string());
-          os << rhs;
-          return lhs + os.str().size();
-        });
     print_digit_counts();
   }
 } data;
 
-void finalize(benchmark::State& state, size_t result) {
-  auto expected = state.iterations() * data.total_length;
+// Returns the lengths of data values formatted with iostreams in locale loc.
+const std::vector<unsigned char>& value_lengths(const Locale& loc) {
+  static std::mutex mutex;
+  static std::map<std::string, std::vector<unsigned char>> lengths;
+  std::lock_guard<std::mutex> lock(mutex);
+  auto it = lengths.find(loc.name);
+  if (it != lengths.end()) return it->second;
+  std::ostringstream os;
+  os.imbue(loc.make());
+  std::vector<unsigned char> result;
+  result.reserve(data.values.size());
+  for (auto value : data) {
+    os.str(std::string());
+    os << value;
+    result.push_back(static_cast<unsigned char>(os.str().size()));
+  }
+  return lengths.emplace(loc.name, std::move(result)).first->second;
+}
+
+// Returns the total length of the first n data values formatted with
+// iostreams in locale loc, wrapping around at the end of data.
+size_t total_length(const Locale& loc, size_t n) {
+  const auto& lengths = value_lengths(loc);
+  auto length = [&](size_t count) {
+    return std::accumulate(lengths.begin(), lengths.begin() + count, size_t());
+  };
+  return n / lengths.size() * length(lengths.size()) +
+         length(n % lengths.size());
+}
+
+// Returns the total length of data formatted with iostreams in locale loc.
+size_t total_length(const Locale& loc) {
+  return total_length(loc, data.values.size());
+}
+
+// Returns the locale with the given name from a cache shared by all threads.
+const std::locale& cached_locale(const Locale& loc) {
+  static std::shared_mutex mutex;
+  static std::map<std::string, std::locale> cache;
+  {
+    std::shared_lock<std::shared_mutex> lock(mutex);
+    auto it = cache.find(loc.name);
+    if (it != cache.end()) return it->second;
+  }
+  std::unique_lock<std::shared_mutex> lock(mutex);
+  return cache.emplace(loc.name, loc.make()).first->second;
+}
+
+// Runs a benchmark on 1, 2, 4, ... threads up to the number of hardware
+// threads. Real time is used so that items_per_second gives the total
+// throughput of all threads.
+void thread_range(benchmark::internal::Benchmark* b) {
+  b->ThreadRange(1, std::max(1u, std::thread::hardware_concurrency()))
+      ->UseRealTime();
+}
+
+void finalize(benchmark::State& state, const Locale& loc, size_t result,
+              const alloc_scope& allocs) {
+  auto expected = state.iterations() * total_length(loc);
   if (result != expected) {
-    throw std::logic_error(
-      fmt::format("invalid length: {} != {}", result, expected));
+    state.SkipWithError("invalid length");
+    return;
   }
-  state.SetItemsProcessed(state.iterations() * data.values.size());
+  auto items = state.iterations() * data.values.size();
+  state.SetItemsProcessed(items);
+  set_alloc_counters(state, allocs, items);
   benchmark::DoNotOptimize(result);
 }
 
-void ostringstream(benchmark::State& state) {
+// Warm: formats with iostreams using a stream imbued once.
+void ostringstream(benchmark::State& state, const Locale& loc) {
+  total_length(loc);
+  alloc_scope allocs;
   size_t result = 0;
   std::ostringstream os;
-  os.imbue(std::locale(std::locale(), new separate_thousands()));
+  os.imbue(loc.make());
   while (state.KeepRunning()) {
     for (auto value : data) {
       os.str(std::string());
@@ -88,18 +162,123 @@ void ostringstream(benchmark::State& state) {
       result += os.str().size();
     }
   }
-  finalize(state, result);
+  finalize(state, loc, result, allocs);
 }
-BENCHMARK(ostringstream);
 
-void format_locale(benchmark::State& state) {
+// Warm: formats with a locale constructed once.
+void format_locale(benchmark::State& state, const Locale& loc) {
+  total_length(loc);
+  alloc_scope allocs;
   size_t result = 0;
-  auto loc = std::locale(std::locale(), new separate_thousands());
+  auto l = loc.make();
   while (state.KeepRunning()) {
-    for (auto value : data) result += fmt::format(loc, "{:L}", value).size();
+    for (auto value : data) result += fmt::format(l, "{:L}", value).size();
   }
-  finalize(state, result);
+  finalize(state, loc, result, allocs);
 }
-BENCHMARK(format_locale);
 
-BENCHMARK_MAIN();
+// Cached: looks up the locale in a shared cache for each value.
+void format_locale_cached(benchmark::State& state, const Locale& loc) {
+  total_length(loc);
+  cached_locale(loc);
+  alloc_scope allocs;
+  size_t result = 0;
+  while (state.KeepRunning()) {
+    for (auto value : data)
+      result += fmt::format(cached_locale(loc), "{:L}", value).size();
+  }
+  finalize(state, loc, result, allocs);
+}
+
+// Cold: constructs the locale and formats one value with it on each
+// iteration, i.e. the cost of the first use of a locale.
+void format_locale_cold(benchmark::State& state, const Locale& loc) {
+  total_length(loc);
+  alloc_scope allocs;
+  size_t result = 0;
+  size_t i = 0;
+  while (state.KeepRunning()) {
+    result += fmt::format(loc.make(), "{:L}", data.values[i]).size();
+    if (++i == data.values.size()) i = 0;
+  }
+  if (result != total_length(loc, state.iterations())) {
+    state.SkipWithError("invalid length");
+    return;
+  }
+  benchmark::DoNotOptimize(result);
+  state.SetItemsProcessed(state.iterations());
+  set_alloc_counters(state, allocs, state.iterations());
+}
+
+// Returns the installed locales that can be constructed.
+std::vector<Locale> installed_locales() {
+  std::vector<std::string> names;
+  if (const char* list = std::getenv("LOCALE_BENCHMARK_LOCALES")) {
+    std::istringstream is(list);
+    std::string name;
+    while (std::getline(is, name, ','))
+      if (!name.empty()) names.push_back(name);
+  }
+#ifndef _WIN32
+  else if (std::FILE* f = popen("locale -a 2>/dev/null", "r")) {
+    char line[256];
+    while (std::fgets(line, sizeof(line), f)) {
+      std::string name = line;
+      name.erase(name.find_last_not_of("\r\n") + 1);
+      if (!name.empty()) names.push_back(name);
+    }
+    pclose(f);
+  }
+#endif
+  std::vector<Locale> locales;
+  for (const auto& name : names) {
+    try {
+      std::locale loc(name);
+    } catch (const std::runtime_error&) {
+      fmt::print(stderr, "Skipping unsupported locale {}\n", name);
+      continue;
+    }
+    locales.push_back({name, [name] { return std::locale(name); }});
+  }
+  return locales;
+}
+
+// Returns locales with thousands, Indian (lakh), myriad and no grouping.
+std::vector<Locale> grouping_locales() {
+  std::vector<Locale> locales;
+  std::pair<const char*, const char*> groupings[] = {
+      {"grouping:3", "\3"},
+      {"grouping:3,2", "\3\2"},
+      {"grouping:4", "\4"},
+      {"grouping:none", ""}};
+  for (auto g : groupings) {
+    std::string grouping = g.second;
+    locales.push_back({g.first, [grouping] {
+                         return std::locale(std::locale::classic(),
+                                            new grouping_numpunct(grouping));
+                       }});
+  }
+  return locales;
+}
+
+int main(int argc, char** argv) {
+  auto locales = grouping_locales();
+  auto installed = installed_locales();
+  locales.insert(locales.end(), installed.begin(), installed.end());
+  using benchmark_fn = void (*)(benchmark::State&, const Locale&);
+  std::pair<const char*, benchmark_fn> benchmarks[] = {
+      {"ostringstream", ostringstream},
+      {"format_locale", format_locale},
+      {"format_locale_cached", format_locale_cached},
+      {"format_locale_cold", format_locale_cold}};
+  for (auto b : benchmarks) {
+    for (const auto& loc : locales) {
+      auto name = std::string(b.first) + "/" + loc.name;
+      benchmark::RegisterBenchmark(name.c_str(), b.second, loc)
+          ->Apply(thread_range);
+    }
+  }
+  benchmark::Initialize(&argc, argv);
+  if (benchmark::ReportUnrecognizedArguments(argc, argv)) return 1;
+  benchmark::RunSpecifiedBenchmarks();
+}
@@ -0,0 +1,232 @@
+// A benchmark of formatting integers into an output file
+//
+// Formats large volumes of integers, one per line, into a memory-mapped file
+// region, into a file via buffered fwrite or directly with fprintf and
+// fmt::print. Formatting into a reused buffer without writing the output
+// anywhere gives the baseline.
+//
+// The output file is $SINK_BENCHMARK_FILE or sink-benchmark.out in $TMPDIR
+// and the volume in MiB is $SINK_BENCHMARK_MIB (1024 by default).
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include <algorithm>
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+#include <vector>
+
+#include <benchmark/benchmark.h>
+#include <fmt/format.h>
+
+struct Data {
+  std::vector<int> values;
+  size_t pass_size;  // The output size of one pass over values.
+
+  Data() : values(1'000'000) {
+    // Same data as in Boost Karma int generator test:
+    // https://www.boost.org/doc/libs/1_63_0/libs/spirit/workbench/karma/int_generator.cpp
+    std::srand(0);
+    std::generate(values.begin(), values.end(), []() {
+      int scale = std::rand() / 100 + 1;
+      return (std::rand() * std::rand()) / scale;
+    });
+    pass_size = 0;
+    for (auto value : values) pass_size += fmt::format_int(value).size() + 1;
+  }
+} data;
+
+std::string output_filename() {
+  if (const char* filename = std::getenv("SINK_BENCHMARK_FILE"))
+    return filename;
+  const char* dir = std::getenv("TMPDIR");
+  return std::string(dir && *dir ? dir : "/tmp") + "/sink-benchmark.out";
+}
+
+// Sets the volume argument from SINK_BENCHMARK_MIB.
+void volume_args(benchmark::internal::Benchmark* b) {
+  const char* mib = std::getenv("SINK_BENCHMARK_MIB");
+  b->ArgNames({"mib"})->Arg(mib && *mib ? std::atoi(mib) : 1024);
+  b->Unit(benchmark::kMillisecond);
+}
+
+// Returns the number of passes over data needed to write the volume given by
+// the benchmark argument. All benchmarks write the same number of bytes.
+size_t num_passes(const benchmark::State& state) {
+  size_t volume = static_cast<size_t>(state.range(0)) << 20;
+  return std::max<size_t>((volume + data.pass_size - 1) / data.pass_size, 1);
+}
+
+void finalize(benchmark::State& state, size_t size) {
+  auto expected = state.iterations() * num_passes(state) * data.pass_size;
+  if (size != expected) {
+    state.SkipWithError("invalid output size");
+    return;
+  }
+  state.SetBytesProcessed(size);
+  state.SetItemsProcessed(state.iterations() * num_passes(state) *
+                          data.values.size());
+}
+
+// Formatting methods. Each writes a value followed by a newline to out,
+// possibly followed by a null terminator, and returns a pointer past the
+// newline.
+
+struct sprintf_method {
+  char* operator()(char* out, int value) const {
+    return out + std::sprintf(out, "%d\n", value);
+  }
+};
+
+struct format_to_method {
+  char* operator()(char* out, int value) const {
+    return fmt::format_to(out, "{}\n", value);
+  }
+};
+
+struct format_int_method {
+  char* operator()(char* out, int value) const {
+    auto f = fmt::format_int(value);
+    out = std::copy(f.data(), f.data() + f.size(), out);
+    *out++ = '\n';
+    return out;
+  }
+};
+
+// Formats into a reused buffer discarding the output.
+template <typename Method>
+void to_buffer(benchmark::State& state, Method method) {
+  size_t size = 0;
+  auto passes = num_passes(state);
+  while (state.KeepRunning()) {
+    for (size_t i = 0; i < passes; ++i) {
+      for (auto value : data.values) {
+        char buf[16];
+        size += method(buf, value) - buf;
+      }
+    }
+  }
+  finalize(state, size);
+}
+
+// Formats into a file region mapped with mmap. Mapping, page faults and
+// unmapping are measured.
+template <typename Method>
+void to_mmap(benchmark::State& state, Method method) {
+  auto filename = output_filename();
+  int fd = open(filename.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0644);
+  if (fd == -1) {
+    state.SkipWithError("cannot open output file");
+    return;
+  }
+  auto passes = num_passes(state);
+  // Leave room for a null terminator.
+  size_t capacity = passes * data.pass_size + 1;
+  size_t size = 0;
+  bool ok = true;
+  while (state.KeepRunning()) {
+    state.PauseTiming();
+    ok = ftruncate(fd, 0) == 0 && ftruncate(fd, capacity) == 0;
+    state.ResumeTiming();
+    void* region = ok ? mmap(nullptr, capacity, PROT_READ | PROT_WRITE,
+                             MAP_SHARED, fd, 0)
+                      : MAP_FAILED;
+    if (region == MAP_FAILED) {
+      ok = false;
+      state.SkipWithError("cannot map output file");
+      break;
+    }
+    char* start = static_cast<char*>(region);
+    char* out = start;
+    for (size_t i = 0; i < passes; ++i) {
+      for (auto value : data.values) out = method(out, value);
+    }
+    size += out - start;
+    munmap(region, capacity);
+  }
+  close(fd);
+  unlink(filename.c_str());
+  if (ok) finalize(state, size);
+}
+
+// Calls write(file) on each iteration with an empty output file and
+// measures it together with flushing the file buffer.
+template <typename Write>
+void write_file(benchmark::State& state, Write write) {
+  auto filename = output_filename();
+  std::FILE* file = std::fopen(filename.c_str(), "w");
+  if (!file) {
+    state.SkipWithError("cannot open output file");
+    return;
+  }
+  size_t size = 0;
+  bool ok = true;
+  while (state.KeepRunning()) {
+    state.PauseTiming();
+    std::rewind(file);
+    ok = ftruncate(fileno(file), 0) == 0;
+    state.ResumeTiming();
+    if (!ok) {
+      state.SkipWithError("cannot truncate output file");
+      break;
+    }
+    write(file);
+    std::fflush(file);
+    size += std::ftell(file);
+  }
+  std::fclose(file);
+  std::remove(filename.c_str());
+  if (ok) finalize(state, size);
+}
+
+// Formats into a buffer and writes it to a file with buffered fwrite.
+template <typename Method>
+void to_fwrite(benchmark::State& state, Method method) {
+  auto passes = num_passes(state);
+  write_file(state, [&](std::FILE* file) {
+    for (size_t i = 0; i < passes; ++i) {
+      for (auto value : data.values) {
+        char buf[16];
+        std::fwrite(buf, 1, method(buf, value) - buf, file);
+      }
+    }
+  });
+}
+
+void fprintf(benchmark::State& state) {
+  auto passes = num_passes(state);
+  write_file(state, [&](std::FILE* file) {
+    for (size_t i = 0; i < passes; ++i) {
+      for (auto value : data.values) std::fprintf(file, "%d\n", value);
+    }
+  });
+}
+BENCHMARK(fprintf)->Apply(volume_args);
+
+void fmt_print(benchmark::State& state) {
+  auto passes = num_passes(state);
+  write_file(state, [&](std::FILE* file) {
+    for (size_t i = 0; i < passes; ++i) {
+      for (auto value : data.values) fmt::print(file, "{}\n", value);
+    }
+  });
+}
+BENCHMARK(fmt_print)->Apply(volume_args);
+
+BENCHMARK_CAPTURE(to_buffer, sprintf, sprintf_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_buffer, format_to, format_to_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_buffer, format_int, format_int_method())
+    ->Apply(volume_args);
+
+BENCHMARK_CAPTURE(to_fwrite, sprintf, sprintf_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_fwrite, format_to, format_to_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_fwrite, format_int, format_int_method())
+    ->Apply(volume_args);
+
+BENCHMARK_CAPTURE(to_mmap, sprintf, sprintf_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_mmap, format_to, format_to_method())->Apply(volume_args);
+BENCHMARK_CAPTURE(to_mmap, format_int, format_int_method())->Apply(volume_args);
+
+BENCHMARK_MAIN();
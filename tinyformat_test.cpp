@@ -73,7 +73,8 @@ static int profiling_enabled = ProfilingIsEnabledForAllThreads();
 #endif
 
 #ifdef SPEED_TEST
-void speedTest(const std::string& which)
+// Returns 0 on success and 1 if the method is not available in this build.
+int speedTest(const std::string& which)
 {
     // Following is required so that we're not limited by per-character
     // buffering.
@@ -139,6 +140,7 @@ void speedTest(const std::string& which)
                 1.234, 42, 3.13, "str", (void*)1000, 'X');
 #else
         fprintf(stderr, "folly is not available\n");
+        return 1;
 #endif
     }
     else if(which == "boost")
@@ -150,6 +152,7 @@ void speedTest(const std::string& which)
                 % 1.234 % 42 % 3.13 % "str" % (void*)1000 % (int)'X';
 #else
         fprintf(stderr, "boost is not available\n");
+        return 1;
 #endif
     }
     else if(which == "stb_sprintf")
@@ -164,8 +167,10 @@ void speedTest(const std::string& which)
     }
     else
     {
-        assert(0 && "speed test for which version?");
+        fprintf(stderr, "%s is not available\n", which.c_str());
+        return 1;
     }
+    return 0;
 }
 #endif
 
@@ -174,7 +179,7 @@ int main(int argc, char* argv[])
 {
 #ifdef SPEED_TEST
     if(argc >= 2)
-        speedTest(argv[1]);
+        return speedTest(argv[1]);
     return 0;
 #else
     return unitTests();
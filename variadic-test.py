@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Script to test how much bloating a large project will suffer when using
 # different formatting methods.
@@ -7,14 +7,14 @@
 from __future__ import print_function, division
 
 import argparse
+import multiprocessing
 import os
-import pickle
 import re
+import shutil
 import sys
-from glob import glob
-from subprocess import check_call, Popen, PIPE
-from timeit import timeit
+from subprocess import CalledProcessError, check_call
 
+import benchutil
 
 parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers(help='possible commands', dest='command')
@@ -24,9 +24,50 @@ parser_bench.add_argument('min', type=int, help='minimum number of arguments')
 parser_bench.add_argument('max', type=int, help='maximum number of arguments')
 parser_bench.add_argument('num_translation_units', metavar='N', type=int,
                           help='number of translation units')
+parser_bench.add_argument('-j', '--jobs', type=int, default=1,
+                          help='number of benchmarks to run concurrently')
+parser_bench.add_argument('--cpus-per-job', type=int, default=1,
+                          help='number of CPUs each concurrent benchmark is '
+                               'pinned to')
+benchutil.add_sampling_arguments(parser_bench, runs=3)
+benchutil.add_cache_arguments(parser_bench)
+parser_bench.add_argument('--output', type=str,
+                          default=benchutil.DEFAULT_RESULTS_FILENAME,
+                          help='results file to append to')
+parser_bench.add_argument('--generate', choices=['selected', 'all'],
+                          default='selected',
+                          help='generate code only for the method being '
+                               'measured or for all methods selected with '
+                               'the preprocessor')
+parser_bench.add_argument('--headers', default='include',
+                          help='comma-separated list of the ways the headers '
+                               'of each method are used: include (in each '
+                               'TU), pch (precompiled header) or header-unit '
+                               '(C++20 header unit)')
+parser_bench.add_argument('--ccache', action='store_true',
+                          help='build through ccache with a private cache per '
+                               'benchmark and measure a cold build filling '
+                               'the cache, a warm build hitting it and the '
+                               'cache size, the artifact cache is not used')
+parser_bench.add_argument('--linkers', default='default',
+                          help='comma-separated list of linkers to link each '
+                               'benchmark with in addition to the regular '
+                               'build: default, bfd, gold, lld, mold or all '
+                               'available ones')
+parser_bench.add_argument('--lto', default='none',
+                          help='comma-separated list of link-time '
+                               'optimization modes to link each benchmark '
+                               'with: none, full (-flto) or thin (-flto=thin, '
+                               'clang only)')
+parser_bench.add_argument('--time-report', action='store_true',
+                          help='report the compile time per compiler phase '
+                               'using -ftime-report (GCC) or -ftime-trace '
+                               '(clang), this adds some overhead to the '
+                               'measured compile time')
 
 parser_plot = subparsers.add_parser('plot', help='plot the results')
-parser_plot.add_argument('--filename', type=str, default='variadic-test.pkl',
+parser_plot.add_argument('--filename', type=str,
+                         default=benchutil.DEFAULT_RESULTS_FILENAME,
                          help='bench result file path')
 
 parser_plotdiff = subparsers.add_parser(
@@ -39,7 +80,23 @@ parser_plotdiff.add_argument('--method', type=str, default='C++ Format',
 parser_plotdiff.add_argument('--config', type=str, default='optimized',
                              help='optimized or debug')
 
+parser_compare = subparsers.add_parser(
+  'compare', help='compare result files and fail on regressions'
+)
+parser_compare.add_argument('files', type=str, nargs='+',
+                            help='result files to be compared, the first one '
+                                 'is the baseline')
+parser_compare.add_argument('--time-threshold', type=float, default=5,
+                            help='minimum compile time increase in percent to '
+                                 'be reported as a regression')
+parser_compare.add_argument('--size-threshold', type=float, default=1,
+                            help='minimum size increase in percent to be '
+                                 'reported as a regression')
+
 options, more_compiler_flags = parser.parse_known_args(sys.argv[1:])
+if 'cache_dir' in options:
+  # Jobs run in their own directories but share the artifact cache.
+  options.cache_dir = os.path.abspath(options.cache_dir)
 
 if 'plot' in options.command:
   import numpy as np
@@ -48,7 +105,11 @@ if 'plot' in options.command:
 
 
 prefix = '_variadic_test_tmp_'
-NUM_RUNS = 3
+# Concurrent benchmarks run in their own subdirectories of this directory.
+jobs_dir = os.path.abspath(prefix + 'jobs')
+# Generated sources shared by the benchmarks of all configs.
+sources_dir = os.path.abspath(prefix + 'sources')
+fmt_dir = os.path.abspath('fmt')
 use_clobber = False
 
 configs = [
@@ -59,11 +120,20 @@ configs = [
 methods = [
   ('printf'      , []),
   ('IOStreams'   , ['-DUSE_IOSTREAMS']),
-  ('fmt'         , ['-DUSE_FMT', '-Lfmt', '-lfmt']),
+  ('fmt'         , ['-DUSE_FMT', '-L' + fmt_dir, '-lfmt']),
   ('tinyformat'  , ['-DUSE_TINYFORMAT']),
   ('Boost Format', ['-DUSE_BOOST'])
 ]
 
+# Keys of method_templates by method name.
+method_keys = {
+  'printf': 'printf',
+  'IOStreams': 'iostream',
+  'fmt': 'fmt',
+  'tinyformat': 'tinyformat',
+  'Boost Format': 'boost'
+}
+
 method_templates = {
   'boost': {
     'statement': r'std::cout << boost::format("{fmt_str}\n") % {args};',
@@ -92,40 +162,23 @@ method_templates = {
   }
 }
 
-main_template = r'''
-#ifdef USE_BOOST
-
-#include <boost/format.hpp>
-#include <iostream>
-
-{boost}
-
-#elif defined(USE_FMT)
-
-#include "fmt/format.h"
-
-{fmt}
-
-#elif defined(USE_IOSTREAMS)
-
-#include <iostream>
-
-{iostream}
-
-#elif defined(USE_TINYFORMAT)
-
-#include "tinyformat.h"
-
-{tinyformat}
-
-#else
-
-#include <stdio.h>
-
-{printf}
+method_includes = {
+  'boost': ['<boost/format.hpp>', '<iostream>'],
+  'fmt': ['"fmt/format.h"'],
+  'iostream': ['<iostream>'],
+  'tinyformat': ['"tinyformat.h"'],
+  'printf': ['<stdio.h>']
+}
 
-#endif
-'''
+# Preprocessor conditions selecting the methods in sources generated for all
+# methods.
+method_conditions = [
+  ('boost', '#ifdef USE_BOOST'),
+  ('fmt', '#elif defined(USE_FMT)'),
+  ('iostream', '#elif defined(USE_IOSTREAMS)'),
+  ('tinyformat', '#elif defined(USE_TINYFORMAT)'),
+  ('printf', '#else')
+]
 
 
 def make_format_string(method, args):
@@ -155,57 +208,40 @@ def generate_args(start_n):
     n += 1
 
 
-def make_function(func_def, method, n, num_args):
+def write_function(f, func_def, method, n, num_args):
   from itertools import islice
   mul = 5
   args = list(islice(generate_args(n), 2 * mul * num_args))
 
-  statements = [make_statement(method, args[shift:shift + num_args])
-                for shift in range(mul * num_args)]
-
   if use_clobber:
     sep = ' asm volatile("" : : : "memory");\n  '
   else:
     sep = '\n  '
 
-  function = (func_def + ' {{\n'
-              '  {}\n'
-              '}}').format(sep.join(statements))
-  return function
+  f.write(func_def + ' {\n  ')
+  for shift in range(mul * num_args):
+    if shift:
+      f.write(sep)
+    f.write(make_statement(method, args[shift:shift + num_args]))
+  f.write('\n}\n')
 
 
-def make_template(func_def, n, num_args):
-  functions = {k: make_function(func_def, v, n, num_args)
-               for k, v in method_templates.items()}
-  return main_template.format(**functions)
-
-
-class Table:
-  """Prints a reStructuredText table"""
-
-  def __init__(self, header, formats):
-    self.widths = [len(i) for i in header]
-    self.formats = formats
-
-    self.print_rulers()
-    for field, width in zip(header, self.widths):
-      print(self.format_field(field, '', width), end=' ')
-    print()
-    self.print_rulers()
-
-  @staticmethod
-  def format_field(field, fmt='', width=''):
-    return '{:{}{}}'.format(field, width, fmt)
-
-  def print_rulers(self):
-    for w in self.widths:
-      print('=' * w, end=' ')
-    print()
-
-  def print_row(self, *row):
-    for field, fmt, width in zip(row, self.formats, self.widths):
-      print(self.format_field(field, fmt, width), end=' ')
-    print()
+def write_source(f, func_def, n, num_args, keys):
+  """Writes a source file with a function for each method in keys, selected
+  with the preprocessor if there are several"""
+  for key, condition in method_conditions:
+    if key not in keys:
+      continue
+    if len(keys) > 1:
+      f.write(condition + '\n')
+    f.write('\n')
+    for include in method_includes[key]:
+      f.write('#include {}\n'.format(include))
+    f.write('\n')
+    write_function(f, func_def, method_templates[key], n, num_args)
+    f.write('\n')
+  if len(keys) > 1:
+    f.write('#endif\n')
 
 
 def to_kib(n):
@@ -213,18 +249,9 @@ def to_kib(n):
   return int(round(n / 1024.0))
 
 
-def remove_old_files():
-  filenames = glob(prefix + '??.cc')
-  for f in [prefix + 'main.cc', prefix + 'all.h']:
-    if os.path.exists(f):
-      filenames.append(f)
-  for f in filenames:
-    os.remove(f)
-
-
-def generate_files(num_args):
-  main_source = prefix + 'main.cc'
-  main_header = prefix + 'all.h'
+def generate_files(directory, num_args, keys):
+  main_source = os.path.join(directory, prefix + 'main.cc')
+  main_header = os.path.join(directory, prefix + 'all.h')
   sources = [main_source]
   with open(main_source, 'w') as cppfile, open(main_header, 'w') as hppfile:
     cppfile.write(re.sub('^ +', '', '''\
@@ -244,11 +271,12 @@ def generate_files(num_args):
       func_name = 'doFormat_a' + n
       func_params = '(int i, float f, const char* s)'
       func_def = 'void ' + func_name + func_params
-      source = prefix + n + '.cc'
+      source = os.path.join(directory, prefix + n + '.cc')
       sources.append(source)
 
       with open(source, 'w') as f:
-        f.write(make_template(func_def, i, num_args))
+        f.write(benchutil.HEADER_UNIT_PRELUDE)
+        write_source(f, func_def, i, num_args, keys)
 
       cppfile.write(func_name + '(1, 1.0f, "String");\n')
       hppfile.write(func_def + ';\n')
@@ -257,6 +285,28 @@ def generate_files(num_args):
   return sources
 
 
+def generated_sources(method, num_args):
+  """Returns the sources for method and num_args arguments generating them
+  if they don't exist yet. The sources are shared by all configs."""
+  key = method_keys[method] if options.generate == 'selected' else 'all'
+  directory = os.path.join(sources_dir, '{}-{}'.format(key, num_args))
+  if not os.path.exists(directory):
+    # Generate into a temporary directory and rename it so that concurrent
+    # jobs never see partially written sources.
+    tmp_dir = '{}.tmp{}'.format(directory, os.getpid())
+    os.makedirs(tmp_dir)
+    keys = [key] if key != 'all' else list(method_templates)
+    generate_files(tmp_dir, num_args, keys)
+    try:
+      os.rename(tmp_dir, directory)
+    except OSError:
+      # Another job has generated the same sources.
+      shutil.rmtree(tmp_dir)
+  return [os.path.join(directory, prefix + 'main.cc')] + [
+    os.path.join(directory, prefix + '{:03}.cc'.format(i))
+    for i in range(options.num_translation_units)]
+
+
 def find_compiler():
   compiler_path = None
   for path in os.getenv('PATH').split(os.pathsep):
@@ -273,107 +323,435 @@ def find_compiler():
   return compiler_path
 
 
+def object_dir():
+  """Returns the directory of object files creating it if necessary. The
+  sources are shared with concurrent benchmarks so the objects are kept in
+  the current benchmark's directory."""
+  directory = os.path.abspath(prefix + 'objects')
+  if not os.path.exists(directory):
+    os.makedirs(directory)
+  return directory
+
+
 def measure_compile(compiler_path, sources, flags):
-  """Measure compile time and executable size"""
+  """Measure compile and link time and executable size"""
   output_filename = prefix + '.out'
-  if os.path.exists(output_filename):
-    os.remove(output_filename)
-
-  include_dir = '-I' + os.path.dirname(os.path.realpath(__file__))
-  command = 'check_call({})'.format(
-    [compiler_path, '-std=c++11', '-o', output_filename,
-     include_dir] + sources + flags + more_compiler_flags
-  )
+  # Compile the sources one at a time as a single compiler command would.
+  build_result = benchutil.build(compiler_path, sources, output_filename, flags,
+                                 1, options.time_report,
+                                 object_dir=object_dir())
 
   result = {
-    'time': timeit(command, number=1,
-                   setup='from subprocess import check_call'),
+    'time': build_result['cpu_time'],
+    'wall_time': build_result['wall_time'],
+    'link_time': build_result['link']['cpu_time'],
+    'link_max_rss': build_result['link']['max_rss'],
     'size': os.stat(output_filename).st_size
   }
+  if options.time_report:
+    result['phases'] = build_result['phases']
 
   check_call(['strip', output_filename])
   result['stripped_size'] = os.stat(output_filename).st_size
+  sys.stdout.flush()
 
-  p = Popen(['./' + output_filename], stdout=PIPE,
-            env={'LD_LIBRARY_PATH': 'fmt'})
-  result['output'] = p.communicate()[0]
+  return result
+
+
+def measure_ccache(compiler_path, sources, flags):
+  """Measure the compile time of a cold build through ccache filling an
+  empty private cache and of a warm build hitting it, the cache size and the
+  executable size"""
+  cache_dir = os.path.abspath(prefix + 'ccache')
+  if os.path.exists(cache_dir):
+    shutil.rmtree(cache_dir)
+  os.makedirs(cache_dir)
+  launcher = [benchutil.find_program('ccache')]
+  env = benchutil.ccache_env(cache_dir)
+  output_filename = prefix + '.out'
+
+  def build():
+    return benchutil.build(compiler_path, sources, output_filename, flags, 1,
+                           launcher=launcher, env=env, object_dir=object_dir())
+
+  cold = build()
+  result = {'ccache_size': benchutil.directory_size(cache_dir)}
+  warm = build()
+  result['time'] = cold['cpu_time']
+  result['wall_time'] = cold['wall_time']
+  result['link_time'] = cold['link']['cpu_time']
+  result['link_max_rss'] = cold['link']['max_rss']
+  result['warm_time'] = warm['cpu_time']
+  result['warm_wall_time'] = warm['wall_time']
+  result['size'] = os.stat(output_filename).st_size
+  check_call(['strip', output_filename])
+  result['stripped_size'] = os.stat(output_filename).st_size
   sys.stdout.flush()
 
   return result
 
 
-def bench_single(num_args, flags):
-  remove_old_files()
-  sources = generate_files(num_args)
+def run_program(filename):
+  """Runs the program and returns the digest and size of its output"""
+  return benchutil.output_digest(['./' + filename],
+                                 env={'LD_LIBRARY_PATH': fmt_dir})
+
+
+def bench_single(method, num_args, flags, mode, link_combinations):
+  sources = generated_sources(method, num_args)
   compiler_path = find_compiler()
+  output_filename = prefix + '.out'
 
-  result = {}
-  for i in range(NUM_RUNS):
+  include_dir = '-I' + os.path.dirname(os.path.realpath(__file__))
+  flags = ['-std=c++11', include_dir] + flags + more_compiler_flags
+  if options.time_report:
+    flags += benchutil.time_report_flags(compiler_path)
+
+  headers = [os.path.join(os.path.dirname(sources[0]), prefix + 'all.h')]
+  mode_flags = []
+  if mode != 'include':
+    header = os.path.abspath(os.path.join(prefix + 'headers', 'precompiled.h'))
+    benchutil.write_header(header, method_includes[method_keys[method]])
+    headers.append(header)
+    mode_flags = benchutil.header_mode_flags(compiler_path, header, mode)
+
+  # The artifact cache would skip the builds measured in ccache mode.
+  cache = None if options.ccache else benchutil.open_cache(options)
+  if cache:
+    # All TUs include the same headers.
+    dependencies = benchutil.dependency_files(compiler_path, sources[:2], flags)
+    key = cache.key(benchutil.hash_files(sources + headers),
+                    benchutil.hash_files(dependencies),
+                    flags + mode_flags,
+                    benchutil.compiler_identity(compiler_path),
+                    benchutil.sampling_key(options))
+    entry = None if options.cold else cache.get(key)
+    if entry and 'wall_time_samples' not in entry[1]:
+      entry = None
+    if entry and link_combinations and \
+       [[l['linker'], l['lto']] for l in entry[1].get('links') or []] != \
+       link_combinations:
+      entry = None
+    if entry:
+      path, result = entry
+      shutil.copy(os.path.join(path, 'a.out'), output_filename)
+      result['cached'] = True
+      result['output_digest'] = run_program(output_filename)
+      return result
+
+  # The header is precompiled once and reused by all samples.
+  precompiled = None
+  if mode != 'include':
+    precompiled = benchutil.precompile_header(
+      compiler_path, header, flags, mode)
+  measure = measure_ccache if options.ccache else measure_compile
+  samples, summary = benchutil.sample(
+    lambda: measure(compiler_path, sources, flags + mode_flags),
+    lambda r: r['time'], options)
+  result = samples[-1]
+  if any(r[k] != result[k] for r in samples for k in ('size', 'stripped_size')):
+    raise Exception('size mismatch')
+  result['time'] = summary['median']
+  result['time_mad'] = summary['mad']
+  result['time_ci'] = (summary['ci_low'], summary['ci_high'])
+  result['time_samples'] = summary['samples']
+  result['wall_time_samples'] = [r['wall_time'] for r in samples]
+  result['wall_time'] = benchutil.median(result['wall_time_samples'])
+  result['flags'] = flags + mode_flags
+  result['pch_time'] = precompiled['cpu_time'] if precompiled else None
+  result['pch_size'] = precompiled['size'] if precompiled else None
+  result['link_time_samples'] = [r['link_time'] for r in samples]
+  result['link_time'] = benchutil.median(result['link_time_samples'])
+  result['link_max_rss'] = benchutil.median(
+    [r['link_max_rss'] for r in samples])
+  if options.ccache:
+    result['warm_time_samples'] = [r['warm_time'] for r in samples]
+    result['warm_time'] = benchutil.median(result['warm_time_samples'])
+  if options.time_report:
+    result['phases'] = {
+      phase: benchutil.median([r['phases'].get(phase, 0) for r in samples])
+      for phase in result['phases']}
+
+  result['links'] = benchutil.link_matrix(
+    compiler_path, sources, flags + mode_flags, 1, link_combinations,
+    prefix + '.link.out', options, object_dir())
+  result['cached'] = False
+
+  if cache:
+    cache.put(key, {'a.out': output_filename}, result)
+  result['output_digest'] = run_program(output_filename)
+  return result
+
+
+def config_label(config, mode):
+  """Returns the config name under which results in header mode are stored"""
+  label = benchutil.header_mode_config(config, mode)
+  if options.ccache:
+    label += '/ccache'
+  return label
+
+
+def bench_job(job):
+  """Runs a single benchmark in its own scratch directory and returns its
+  result or None if a build failed"""
+  method, config, num_args, flags, mode, link_combinations = job
+  job_dir = os.path.join(jobs_dir, re.sub(
+    r'\W', '_', '{}-{}-{}-{}'.format(method, config, mode, num_args)))
+  if not os.path.exists(job_dir):
+    os.makedirs(job_dir)
+  cwd = os.getcwd()
+  os.chdir(job_dir)
+  try:
+    return bench_single(method, num_args, flags, mode, link_combinations)
+  except CalledProcessError as e:
+    print('{} {} with {} arguments failed: {}'.format(
+      config_label(config, mode), method, num_args, e))
     sys.stdout.flush()
+    return None
+  finally:
+    os.chdir(cwd)
+
+
+def init_worker(cpu_set_queue):
+  benchutil.pin_to_cpus(cpu_set_queue.get())
+
+
+def run_jobs(jobs):
+  """Runs benchmark jobs concurrently, each pinned to its own CPU set, and
+  yields their results in order as soon as they are available"""
+  cpu_sets = benchutil.cpu_sets(options.jobs, options.cpus_per_job)
+  if len(cpu_sets) == 1:
+    for job in jobs:
+      yield bench_job(job)
+    return
+
+  print('Running {} jobs concurrently on CPUs {}'.format(
+    len(cpu_sets), cpu_sets))
+  queue = multiprocessing.Queue()
+  for cpus in cpu_sets:
+    queue.put(cpus)
+  pool = multiprocessing.Pool(len(cpu_sets), init_worker, (queue,))
+  try:
+    for result in pool.imap(bench_job, jobs, chunksize=1):
+      yield result
+  finally:
+    pool.close()
+    pool.join()
+
+
+def print_results(method, config, results):
+  print(config, method, 'results:')
+  table = benchutil.Table(
+    ['Args', 'Compile time, s', 'MAD, s', '95% CI, s', 'Wall time, s',
+     'Link time, s', 'Executable size, KiB', 'Stripped size, KiB'],
+    ['', '.1f', '.2f', '', '.1f', '.2f', '', '']
+  )
+  for num_args, result in results:
+    table.print_row(num_args, result['time'], result['time_mad'],
+                    '{:.1f}-{:.1f}'.format(*result['time_ci']),
+                    result['wall_time'], result['link_time'],
+                    to_kib(result['size']),
+                    to_kib(result['stripped_size']))
+  table.print_rulers()
+  print()
 
-    old_result = result
-    result = measure_compile(compiler_path, sources, flags)
+  if options.time_report:
+    phases = benchutil.top_phases([r['phases'] for _, r in results], 6)
+    table = benchutil.Table(['Args'] + [p + ', s' for p in phases],
+                  [''] + ['.2f'] * len(phases))
+    for num_args, result in results:
+      table.print_row(num_args, *[result['phases'].get(p, 0) for p in phases])
+    table.print_rulers()
+    print()
 
-    if 'time' not in old_result:
-      continue
 
-    result['time'] = min(old_result['time'], result['time'])
-    if any(result[k] != old_result[k] for k in ('size', 'stripped_size')):
-      raise Exception('size mismatch')
+def check_output(method, config, expected_list, actual_list):
+  expected_results = dict(expected_list)
+  for num_args, actual in actual_list:
+    expected = expected_results.get(num_args)
+    if expected and expected['output_digest'] != actual['output_digest']:
+      raise Exception(
+        "{} {} output doesn't match for {} arguments: {} bytes with SHA-256 {} "
+        "expected, {} bytes with SHA-256 {} produced".format(
+          config, method, num_args, expected['output_digest'][1],
+          expected['output_digest'][0], actual['output_digest'][1],
+          actual['output_digest'][0]))
+
+
+def print_precompiled(method, config, mode, results, include_results):
+  """Prints the cost of precompiling the headers and the compile time saved
+  per TU compared to including them if include_results are given"""
+  print(config, method, mode, 'precompiled headers:')
+  table = benchutil.Table(
+    ['Args', 'Build time, s', 'Size, KiB', 'Compile time, s',
+     'Saving per TU, ms'],
+    ['', '.2f', '', '.1f', '']
+  )
+  include_results = dict(include_results or [])
+  for num_args, result in results:
+    saving = ''
+    if num_args in include_results:
+      saving = '{:.1f}'.format(
+        (include_results[num_args]['time'] - result['time']) * 1000 /
+        options.num_translation_units)
+    table.print_row(num_args, result['pch_time'], to_kib(result['pch_size']),
+                    result['time'], saving)
+  table.print_rulers()
+  print()
+
 
-  return result
+def print_links(method, config, results):
+  """Prints the link time, peak memory usage of the linker and executable
+  size per linker and LTO mode"""
+  print(config, method, 'linkers:')
+  table = benchutil.Table(
+    ['Args', 'Linker', 'LTO', 'Compile time, s', 'Link time, s',
+     'Link wall time, s', 'Link peak RSS, MiB', 'Executable size, KiB',
+     'Stripped size, KiB'],
+    ['', '', '', '.1f', '.2f', '.2f', '.1f', '', '']
+  )
+  for num_args, result in results:
+    for link in result['links']:
+      table.print_row(num_args, link['linker'], link['lto'],
+                      link['compile_time'], link['time'], link['wall_time'],
+                      link['max_rss'] / 1024.0, to_kib(link['size']),
+                      to_kib(link['stripped_size']))
+  table.print_rulers()
+  print()
 
 
-def bench(method, config, flags):
-  print('Benchmarking', config, method)
-  table = Table(
-    ['Args', 'Compile time, s', 'Executable size, KiB', 'Stripped size, KiB'],
-    ['', '.1f', '', '']
+def print_ccache(method, config, results):
+  """Prints the cold and warm ccache build times and the cache size"""
+  print(config, method, 'ccache:')
+  table = benchutil.Table(
+    ['Args', 'Cold time, s', 'Warm time, s', 'Speedup', 'Cache size, KiB'],
+    ['', '.1f', '.2f', '', '']
   )
-  results = []
-  for num_args in range(options.min, options.max):
-    result = bench_single(num_args, flags)
-    table.print_row(num_args, result['time'], to_kib(result['size']),
-                    to_kib(result['stripped_size']))
-    results.append(result)
+  for num_args, result in results:
+    table.print_row(num_args, result['time'], result['warm_time'],
+                    '{:.1f}x'.format(result['time'] / result['warm_time']),
+                    to_kib(result['ccache_size']))
   table.print_rulers()
   print()
-  return results
 
 
-def check_output(expected_list, actual_list):
-  for expected, actual in zip(expected_list, actual_list):
-    if expected['output'] != actual['output']:
-      print(expected['output'])
-      print(actual['output'])
-      raise Exception("output doesn't match")
+def write_result(writer, job, result):
+  """Writes the runs of a benchmark job to the results file"""
+  method, config, num_args, _, mode, _ = job
+  writer.write(
+    {'method': method, 'config': config_label(config, mode),
+     'args': num_args, 'run': run, 'time': time,
+     'wall_time': result['wall_time_samples'][run], 'size': result['size'],
+     'stripped_size': result['stripped_size'], 'flags': result['flags'],
+     'phases': result.get('phases'),
+     'num_translation_units': options.num_translation_units,
+     'generate': options.generate,
+     'pch_time': result.get('pch_time'),
+     'pch_size': result.get('pch_size'),
+     'warm_time': result['warm_time_samples'][run]
+                  if options.ccache else None,
+     'ccache_size': result.get('ccache_size'),
+     'link_time': result['link_time_samples'][run],
+     'link_max_rss': result['link_max_rss'],
+     'links': result['links'], 'cached': result['cached']}
+    for run, time in enumerate(result['time_samples']))
 
 
 def bench_command():
-  data = {'options': options}
-  for method, method_flags in methods:
-    data[method] = {config: bench(method, config, method_flags + config_flags)
-                    for config, config_flags in configs}
-
-    if 'printf' in data:
-      for config, _ in configs:
-        check_output(data['printf'][config], data[method][config])
+  header_modes = benchutil.parse_header_modes(parser_bench, options.headers)
+  if options.ccache:
+    if not benchutil.find_program('ccache'):
+      parser_bench.error('ccache not found')
+    if options.time_report:
+      parser_bench.error('--ccache cannot be combined with --time-report '
+                         'because ccache replays the time report of cached '
+                         'compilations')
+    if header_modes != ['include']:
+      parser_bench.error('--ccache only supports --headers include')
+  link_combinations = benchutil.parse_link_matrix(
+    parser_bench, find_compiler(), options.linkers, options.lto)
+  if os.path.exists(sources_dir):
+    shutil.rmtree(sources_dir)
+  arg_counts = range(options.min, options.max)
+  jobs = [(method, config, num_args, method_flags + config_flags, mode,
+           link_combinations)
+          for method, method_flags in methods
+          for config, config_flags in configs
+          for mode in header_modes
+          for num_args in arg_counts]
+
+  # Results are written as soon as they are available so that they are not
+  # lost if a later job fails.
+  writer = benchutil.ResultsWriter(options.output, 'variadic-test',
+                                   find_compiler())
+  results = []
+  for job, result in zip(jobs, run_jobs(jobs)):
+    if result is not None:
+      write_result(writer, job, result)
+    results.append(result)
+  failed = sum(1 for r in results if r is None)
+  results = iter(results)
 
+  # Results by method and config name which includes the header mode as
+  # lists of argument counts and results of the successful jobs.
+  data = {}
   for method, _ in methods:
+    data[method] = {}
     for config, _ in configs:
-      for result in data[method][config]:
-        del result['output']
+      for mode in header_modes:
+        label = config_label(config, mode)
+        method_results = [next(results) for _ in arg_counts]
+        data[method][label] = [
+          (num_args, result)
+          for num_args, result in zip(arg_counts, method_results)
+          if result is not None]
+        if not data[method][label]:
+          continue
+        print_results(method, label, data[method][label])
+        if options.ccache:
+          print_ccache(method, label, data[method][label])
+        if link_combinations:
+          print_links(method, label, data[method][label])
+      for mode in header_modes:
+        label = config_label(config, mode)
+        if mode != 'include' and data[method][label]:
+          print_precompiled(method, config, mode, data[method][label],
+                            data[method].get(config))
 
-  with open('variadic-test.pkl', 'wb') as file:
-    pickle.dump(data, file)
+    if 'printf' in data:
+      for label in data[method]:
+        check_output(method, label, data['printf'][label],
+                     data[method][label])
 
+  if failed:
+    sys.exit('{} of {} benchmarks failed'.format(failed, len(jobs)))
 
-def load_data(filename):
-  if not filename.endswith('.pkl'):
-    filename += '.pkl'
 
-  with open(filename, 'rb') as file:
-    return pickle.load(file)
+def load_data(filename):
+  """Loads the most recent variadic-test session from a results file.
+
+  Returns a dict with the sorted argument counts under 'args' and per-method
+  and per-config lists of results, one for each argument count, containing
+  the median compile time and the executable sizes.
+  """
+  if not os.path.splitext(filename)[1]:
+    filename += '.jsonl'
+
+  rows = benchutil.latest_sessions(
+    [r for r in benchutil.load_results(filename)
+     if r['script'] == 'variadic-test'])
+  runs = {}
+  for row in rows:
+    runs.setdefault((row['method'], row['config'], row['args']), []).append(row)
+
+  data = {'args': sorted(set(row['args'] for row in rows))}
+  for (method, config, num_args), method_runs in sorted(runs.items()):
+    data.setdefault(method, {}).setdefault(config, []).append({
+      'time': benchutil.median([r['time'] for r in method_runs]),
+      'size': method_runs[0]['size'],
+      'stripped_size': method_runs[0]['stripped_size']
+    })
+  return data
 
 
 def set_plot_style():
@@ -407,7 +785,7 @@ def plot_subfigure(x, y, prop, **kwargs):
 
 def plot_all(filename, prop):
   data = load_data(filename)
-  x = np.arange(data['options'].min, data['options'].max)
+  x = np.array(data['args'])
 
   def make_y(results):
     y = [result[prop] for result in results]
@@ -443,7 +821,7 @@ def plot_command():
 def plot_diff(filenames, method, config, prop):
   dataset = [load_data(f) for f in filenames]
   baseline = dataset[0][method][config]
-  x = np.arange(dataset[0]['options'].min, dataset[0]['options'].max)
+  x = np.array(dataset[0]['args'])
 
   set_plot_style()
   plt.figure(figsize=(8, 3.5))
@@ -482,8 +860,50 @@ def plotdiff_command():
     plot_diff(options.files, options.method, options.config, prop)
 
 
+def compare_command():
+  if len(options.files) < 2:
+    parser_compare.error('at least two result files are required')
+  dataset = [benchutil.latest_sessions(benchutil.load_results(f))
+             for f in options.files]
+  regressions = []
+  for filename, rows in zip(options.files[1:], dataset[1:]):
+    for r in benchutil.find_regressions(dataset[0], rows,
+                                        options.time_threshold,
+                                        options.size_threshold):
+      r['file'] = filename
+      regressions.append(r)
+  regressions.sort(key=lambda r: r['change'], reverse=True)
+
+  if not regressions:
+    print('No regressions found')
+    return
+  print('Regressions relative to', options.files[0])
+  rows = []
+  for rank, r in enumerate(regressions, 1):
+    script, method, config, args = r['key']
+    if args is None:
+      args = ''
+    elif isinstance(args, tuple):
+      args = '/'.join(str(a) for a in args)
+    value_format = '{:.2f}' if r['metric'] == 'time' else '{}'
+    rows.append((rank, r['file'], script, method, config, args, r['metric'],
+                 value_format.format(r['baseline']),
+                 value_format.format(r['value']),
+                 '{:+.1f}'.format(r['change'])))
+  table = benchutil.Table(
+    ['Rank', 'File', 'Script', 'Method', 'Config', 'Args', 'Metric',
+     'Baseline', 'New', 'Change, %'],
+    [''] * 10, [max(len(str(f)) for f in column) for column in zip(*rows)]
+  )
+  for row in rows:
+    table.print_row(*row)
+  table.print_rulers()
+  sys.exit(1)
+
+
 commands = {
   'bench': bench_command,
+  'compare': compare_command,
   'plot': plot_command,
   'plotdiff': plotdiff_command,
 }